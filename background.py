@@ -8,10 +8,9 @@
 
 
 import random
-from random import uniform
 
 import pygame
-import math
+import numpy
 
 
 def grad(x, y, proportion):
@@ -24,35 +23,31 @@ class VerticalGradient(object):
         self.top_colour    = top_colour
         self.bottom_colour = bottom_colour
         
+        # the gradient is only re-rendered when the colours or size change
+        self.cached_surface = None
+        self.cached_key     = None
+        
+    def render(self, size):
+        width, height = size
+        proportion = numpy.arange(height) / float(height - 1)
+        top    = numpy.array(self.top_colour, float)
+        bottom = numpy.array(self.bottom_colour, float)
+        colours = (bottom * proportion[:, numpy.newaxis] +
+                   top * (1 - proportion[:, numpy.newaxis])).astype(int)
+        
+        # one column, stretched across
+        column = pygame.surfarray.make_surface(
+            colours[numpy.newaxis].astype(numpy.uint8))
+        return pygame.transform.scale(column, size)
+        
     def draw(self, surface):        
-        for y in range(0, surface.get_height()):
-            proportion = float(y) / (surface.get_height() - 1)
-            colour = grad(self.top_colour, self.bottom_colour,
-                          proportion)
-            pygame.draw.line(surface, colour, (0, y),
-                             (surface.get_width() - 1, y))
+        key = (surface.get_size(), tuple(self.top_colour),
+               tuple(self.bottom_colour))
+        if key != self.cached_key:
+            self.cached_surface = self.render(surface.get_size())
+            self.cached_key     = key
+        surface.blit(self.cached_surface, (0, 0))
 
-class Star(object):
-    def __init__(self, position, max_brightness):
-        self.phase = random.uniform(0, 3.14159265 * 2)
-        self.position = position
-        self.max_brightness = max_brightness
-        self.min_brightness = random.uniform(0, self.max_brightness)
-        self.rate = random.uniform(0.03, 0.1)
-    
-    def tick(self, resolution):
-        self.phase += random.uniform(0, self.rate)
-                
-    def draw(self, surface, tmp_surf):
-        brightness = (self.min_brightness + 
-                     ((self.max_brightness - self.min_brightness) * 
-                      (math.sin(self.phase) + 1.0) / 2.0))
-                      
-        if brightness > 1.0:
-            brightness = 1.0
-        
-        tmp_surf.set_alpha(int(255 * brightness))
-        surface.blit(tmp_surf, [int(x) for x in self.position])
             
 class StarryBackground(object):
     def darken(self):    
@@ -67,38 +62,64 @@ class StarryBackground(object):
         
         self.grad.bottom_colour = new_colour
                       
-    def make_star(self):
-        position   = [uniform(0, limit) for limit in self.resolution]
+    def make_stars(self, count):
+        width, height = self.resolution
+        self.star_position = numpy.column_stack(
+            (self.star_random.uniform(0, width, count),
+             self.star_random.uniform(0, height, count))).astype(int)
+        self.star_position[:, 0] = self.star_position[:, 0].clip(0, width - 1)
+        self.star_position[:, 1] = self.star_position[:, 1].clip(0, height - 1)
         
         # max stars nearer to the horizon duller
-        max_brightness = 0.2 + 1.2 * random.random() * (1.0 - (position[1] / self.resolution[1]))
-        if max_brightness > 1.0:
-            max_brightness = 1.0
-        return Star(position, max_brightness)
+        self.star_max_brightness = numpy.minimum(
+            1.0, 0.2 + 1.2 * self.star_random.random_sample(count) *
+                 (1.0 - (self.star_position[:, 1] / float(height))))
+        self.star_min_brightness = (self.star_random.random_sample(count) *
+                                    self.star_max_brightness)
+        self.star_phase = self.star_random.uniform(0, 3.14159265 * 2, count)
+        self.star_rate  = self.star_random.uniform(0.03, 0.1, count)
         
-    def __init__(self, resolution):
+    def __init__(self, resolution, rng=random):
         self.resolution = resolution
+        self.grad = VerticalGradient(top_colour=(0,0,20),
+                                     bottom_colour=(0,0,0))
+        self.new_sky(rng)
+        
+    def new_sky(self, rng=random):
+        """Pick a new sky colour and stars."""
+        # the stars get their own generator, seeded from rng, so that
+        # twinkling (which only happens when drawing) leaves rng alone
+        self.star_random = numpy.random.RandomState(rng.getrandbits(32))
 
         bottom_colour = (0,)
         
         # make sure we get a bright enough colour to see the buildings
         while sum(bottom_colour) < 120:        
-            bottom_colour = (max(0, uniform(-100, 100)),
-                             max(0, uniform(-100, 50)),
-                             max(0, uniform(-100, 200)))
+            bottom_colour = (max(0, rng.uniform(-100, 100)),
+                             max(0, rng.uniform(-100, 50)),
+                             max(0, rng.uniform(-100, 200)))
             
-
-        self.grad = VerticalGradient(top_colour=(0,0,20),
-                                     bottom_colour=bottom_colour)
-                                 
-        self.stars = [self.make_star() for i in range(1000)]
+        self.grad.bottom_colour = bottom_colour
+        self.make_stars(1000)
     
+    def twinkle(self):
+        self.star_phase += (self.star_random.random_sample(len(self.star_phase)) *
+                            self.star_rate)
+        
+    def draw_stars(self, surface):
+        brightness = (self.star_min_brightness + 
+                      ((self.star_max_brightness - self.star_min_brightness) *
+                       (numpy.sin(self.star_phase) + 1.0) / 2.0))
+        alpha = (255 * numpy.minimum(brightness, 1.0)).astype(int)
+        
+        # blend white into the sky, as a blit with per-surface alpha would
+        xs, ys = self.star_position.T
+        pixels = pygame.surfarray.pixels3d(surface)
+        sky    = pixels[xs, ys].astype(int)
+        pixels[xs, ys] = sky + ((255 - sky) * alpha[:, numpy.newaxis]) / 255
+        del pixels  # unlock the surface
+        
     def draw(self, surface):
         self.grad.draw(surface)
-        tmp_surf = pygame.Surface((1, 1))
-        tmp_surf.fill((255, 255, 255))
-        
-        for star in self.stars:
-            star.tick(self.resolution)
-            star.draw(surface, tmp_surf)
-            
+        self.twinkle()
+        self.draw_stars(surface)
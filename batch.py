@@ -0,0 +1,143 @@
+"""
+    Missile Defence Game
+    Runs many headless auto-mode games across a pool of processes.
+
+        $ python batch.py --games 200 --ticks 5000
+
+    Each worker process imports everything and builds one headless game
+    when it starts, then plays every game it is given on that instance.
+    Results are printed as each game finishes, followed by a summary.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import argparse
+import multiprocessing
+import os
+import timeit
+
+import numpy
+
+# the worker's game, made once by _init_worker
+_game = None
+
+
+def _init_worker():
+    global _game
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    import missile_defence
+    _game = missile_defence.MissileDefenceGame(headless=True, auto_mode=True)
+
+
+def play(task):
+    """Play one game of up to ticks ticks from the given seed, stopping
+    early if the city falls. Returns a dict of results."""
+    import profiling
+
+    seed, ticks = task
+    game = _game
+    game.profiler = profiling.Profiler()
+    game.new_game(seed)
+    game.done = False
+
+    score     = 0
+    remaining = 1.0
+    start = timeit.default_timer()
+    while game.tick_count < ticks and not game.done:
+        game.tick()
+        game.profiler.end_tick()
+        # the score and buildings are reset along with the city, so keep
+        # what they were before the tick in which it falls
+        if game.cities_lost:
+            break
+        score     = game.score
+        remaining = game.buildings.total / float(game.initial_buildings_sum)
+    elapsed = timeit.default_timer() - start
+
+    return {
+        "seed":          seed,
+        "score":         score,
+        "ticks":         game.tick_count,
+        "city_lost":     game.cities_lost > 0,
+        "buildings":     remaining,
+        "spawned":       game.missiles_spawned,
+        "ticks_per_sec": game.tick_count / elapsed if elapsed > 0 else 0.0,
+        "phase_ms":      dict((phase, 1000.0 * seconds / game.tick_count)
+                              for (phase, seconds)
+                              in game.profiler.totals.items()),
+    }
+
+
+def run_batch(seeds, ticks, processes=None):
+    """Play a game for each seed, spread over processes worker processes
+    (one per core by default), yielding each game's results as it
+    finishes."""
+    pool = multiprocessing.Pool(processes, _init_worker)
+    try:
+        for result in pool.imap_unordered(play, [(seed, ticks)
+                                                 for seed in seeds]):
+            yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def summarise(results):
+    """The summary table for a list of results, as a string."""
+    lines = ["%-14s %10s %10s %10s %10s" %
+             ("", "mean", "median", "min", "max")]
+
+    def row(name, values, format="%10.1f"):
+        values = numpy.array(values, float)
+        lines.append(("%-14s " + " ".join([format] * 4)) %
+                     (name, values.mean(), numpy.median(values),
+                      values.min(), values.max()))
+
+    row("score", [r["score"] for r in results])
+    row("ticks survived", [r["ticks"] for r in results])
+    row("buildings %", [100 * r["buildings"] for r in results])
+    row("spawned", [r["spawned"] for r in results])
+    row("ticks/sec", [r["ticks_per_sec"] for r in results])
+    for phase in sorted(set().union(*[r["phase_ms"] for r in results])):
+        row(phase + " ms", [r["phase_ms"].get(phase, 0) for r in results],
+            "%10.3f")
+    lost = sum(r["city_lost"] for r in results)
+    lines.append("city lost in %d of %d games" % (lost, len(results)))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Play many auto-mode games")
+    parser.add_argument("--games", type=int, default=100)
+    parser.add_argument("--first-seed", type=int, default=0,
+                        help="games use seeds from this one upwards")
+    parser.add_argument("--ticks", type=int, default=3000,
+                        help="tick budget for each game")
+    parser.add_argument("--processes", type=int,
+                        help="worker processes (default: one per core)")
+    parser.add_argument("--quiet", action="store_true",
+                        help="only print the summary")
+    args = parser.parse_args()
+
+    seeds = range(args.first_seed, args.first_seed + args.games)
+    results = []
+    start = timeit.default_timer()
+    for result in run_batch(seeds, args.ticks, args.processes):
+        results.append(result)
+        if not args.quiet:
+            print("seed %6d  score %7d  ticks %6d  buildings %5.1f%%  "
+                  "spawned %5d  %7.1f ticks/sec" %
+                  (result["seed"], result["score"], result["ticks"],
+                   100 * result["buildings"], result["spawned"],
+                   result["ticks_per_sec"]))
+    elapsed = timeit.default_timer() - start
+
+    print("")
+    print(summarise(results))
+    print("%d games in %.1f seconds" % (len(results), elapsed))
+
+
+if __name__ == "__main__":
+    main()
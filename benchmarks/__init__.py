@@ -0,0 +1,9 @@
+"""
+    Missile Defence Game
+    Reproducible performance benchmarks.
+
+    Run with "python -m benchmarks.run" from the top of the repository.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
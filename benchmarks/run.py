@@ -0,0 +1,232 @@
+"""
+    Missile Defence Game
+    Runs the benchmark scenarios and compares them with a saved baseline.
+
+    Each scenario runs in its own process, under SDL's dummy video driver,
+    with random and numpy.random seeded so every run is the same game.
+    Reported per scenario: ticks per second (tick and draw), time per tick
+    in each profiled phase, peak resident memory, and the peak memory held
+    by each part of the game (see get_memory_use).
+
+    The baseline is specific to the machine it was recorded on, so it is
+    not checked in; without one the comparison fails.
+
+        $ python -m benchmarks.run                   # compare with baseline
+        $ python -m benchmarks.run --save-baseline   # record a new baseline
+        $ python -m benchmarks.run storm chain       # just these scenarios
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "baseline.json")
+
+
+def get_memory_use(game):
+    """Bytes held right now by each part of the game: its NumPy arrays and
+    pygame surfaces. Temporaries that only live during a tick, such as
+    the broadphase's candidate pairs, aren't counted."""
+    import projectiles
+    from sprites import get_sprite_bytes
+
+    def arrays(*arrays):
+        return sum(a.nbytes for a in arrays)
+
+    def surfaces(*surfaces):
+        return sum(get_sprite_bytes(s) for s in surfaces if s is not None)
+
+    physics    = game.physics
+    grid       = physics.grid
+    buildings  = game.buildings
+    background = game.background
+    renderer   = game.renderer
+    return {
+        "physics":    (arrays(grid.cells, grid.order, grid.sorted_keys,
+                              physics.contact_time, physics.contact_with) +
+                       arrays(*game.projectiles.columns.values())),
+        "buildings":  (buildings.map.get_nbytes() +
+                       arrays(buildings.column_counts,
+                              buildings.initial_column_counts,
+                              buildings.skyline, buildings.unsettled)),
+        "background": (arrays(background.star_position,
+                              background.star_max_brightness,
+                              background.star_min_brightness,
+                              background.star_phase, background.star_rate) +
+                       surfaces(background.grad.cached_surface)),
+        "draw":       (surfaces(game.screen, game.buildings_surface,
+                                renderer and renderer.background_layer) +
+                       projectiles.explosion_sprites.bytes +
+                       game.shield_dome.sprites.bytes),
+    }
+
+
+def run_scenario(name, seed):
+    """Play the named scenario in this process and return its results."""
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ["SDL_AUDIODRIVER"] = "dummy"
+
+    import random
+    import resource
+    import timeit
+    import numpy
+    import missile_defence
+    from benchmarks.scenarios import SCENARIOS
+
+    scenario = SCENARIOS[name]
+    random.seed(seed)
+    numpy.random.seed(seed)
+    rng = numpy.random.RandomState(seed)
+
+    game = missile_defence.MissileDefenceGame(auto_mode=True, profile=True,
+                                              seed=seed)
+    game.done = False
+    if scenario.setup is not None:
+        scenario.setup(game, rng)
+
+    elapsed = 0.0
+    peak_memory = {}
+    for tick in range(scenario.ticks):
+        if scenario.each_tick is not None:
+            scenario.each_tick(game, rng, tick)
+        start = timeit.default_timer()
+        game.tick()
+        game.draw()
+        game.profiler.end_tick()
+        elapsed += timeit.default_timer() - start
+
+        for (part, size) in get_memory_use(game).items():
+            peak_memory[part] = max(size, peak_memory.get(part, 0))
+
+    profiler = game.profiler
+    return {
+        "ticks":         scenario.ticks,
+        "ticks_per_sec": scenario.ticks / elapsed,
+        "phase_ms":      dict((phase, 1000.0 * seconds / scenario.ticks)
+                              for (phase, seconds) in profiler.totals.items()),
+        "peak_rss_kb":   resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "peak_kb":       dict((part, size // 1024)
+                              for (part, size) in peak_memory.items()),
+        "score":         game.score,
+    }
+
+
+def run_in_subprocess(name, seed):
+    """Run a scenario in a fresh process, so that its peak memory is its
+    own."""
+    top = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output = subprocess.check_output(
+        [sys.executable, "-m", "benchmarks.run", "--worker", name,
+         "--seed", str(seed)], cwd=top)
+    return json.loads(output.decode("utf-8").splitlines()[-1])
+
+
+def compare(results, baseline, tolerance):
+    """Print each scenario against its baseline and return the list of
+    regressions: ticks per second more than tolerance (a fraction) slower,
+    peak memory (overall or of any part) more than tolerance bigger, or no
+    baseline to compare with."""
+    regressions = []
+    for (name, result) in results.items():
+        if name not in baseline:
+            print("%-8s no baseline" % name)
+            regressions.append("%s: not in the baseline" % name)
+            continue
+        old = baseline[name]
+        speed  = result["ticks_per_sec"] / old["ticks_per_sec"] - 1
+        memory = float(result["peak_rss_kb"]) / old["peak_rss_kb"] - 1
+        print("%-8s %+6.1f%% ticks/sec  %+6.1f%% peak memory" %
+              (name, 100 * speed, 100 * memory))
+        if speed < -tolerance:
+            regressions.append("%s: ticks/sec down %.1f%%" %
+                               (name, -100 * speed))
+        if memory > tolerance:
+            regressions.append("%s: peak memory up %.1f%%" %
+                               (name, 100 * memory))
+            
+        # baselines from before parts were measured have none
+        for (part, size) in sorted(result["peak_kb"].items()):
+            old_size = old.get("peak_kb", {}).get(part)
+            if old_size and float(size) / old_size - 1 > tolerance:
+                regressions.append("%s: %s memory up %.1f%%" %
+                                   (name, part,
+                                    100 * (float(size) / old_size - 1)))
+    return regressions
+
+
+def main():
+    from benchmarks.scenarios import SCENARIOS
+
+    parser = argparse.ArgumentParser(description="Missile defence benchmarks")
+    parser.add_argument("scenarios", nargs="*", metavar="SCENARIO",
+                        help="scenarios to run (default: all of %s)" %
+                             ", ".join(SCENARIOS))
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE,
+                        help="baseline results file")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="write the results to the baseline file "
+                             "instead of comparing with it")
+    parser.add_argument("--tolerance", type=float, default=0.15,
+                        help="allowed slowdown or memory growth, as a "
+                             "fraction (default 0.15)")
+    parser.add_argument("--worker", metavar="SCENARIO",
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_scenario(args.worker, args.seed)))
+        return 0
+
+    names = args.scenarios or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario: %s" % ", ".join(unknown))
+
+    results = {}
+    for name in names:
+        result = run_in_subprocess(name, args.seed)
+        results[name] = result
+        phases = sorted(result["phase_ms"].items(), key=lambda x: -x[1])
+        print("%-8s %8.1f ticks/sec %8d KB peak  %s" %
+              (name, result["ticks_per_sec"], result["peak_rss_kb"],
+               "  ".join("%s %.2fms" % phase for phase in phases[:4])))
+        print("%-8s peak KB: %s" %
+              ("", "  ".join("%s %d" % part
+                             for part in sorted(result["peak_kb"].items()))))
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("saved baseline to %s" % args.baseline)
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("no baseline at %s: run with --save-baseline first" %
+              args.baseline)
+        return 1
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("REGRESSIONS:")
+        for regression in regressions:
+            print("  " + regression)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
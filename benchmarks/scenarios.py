@@ -0,0 +1,73 @@
+"""
+    Missile Defence Game
+    Scripted stress scenarios for the benchmarks.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import collections
+
+import projectiles
+
+
+class Scenario(object):
+    """A scripted game: setup(game, rng) is called once after the game is
+    created and each_tick(game, rng, tick) before every tick. rng is a
+    numpy RandomState, so the script is the same on every run."""
+    def __init__(self, name, ticks, description, setup=None, each_tick=None):
+        self.name        = name
+        self.ticks       = ticks
+        self.description = description
+        self.setup       = setup
+        self.each_tick   = each_tick
+
+
+def _barrage(game, rng):
+    game.projectiles.extend(game.generate_missiles(1000))
+
+
+def _chain(game, rng):
+    # a dense layer of slow missiles just above the city; setting off one
+    # in the middle sets off the rest
+    width, height = game.resolution
+    layer = []
+    for x in range(10, width - 10, 12):
+        for y in range(height - 200, height - 120, 12):
+            m = projectiles.Missile(position=(x + rng.uniform(-3, 3), y),
+                                    velocity=(rng.uniform(-0.5, 0.5),
+                                              rng.uniform(0, 1)),
+                                    rng=game.random)
+            layer.append(m)
+    layer[len(layer) / 2].exploding = True
+    game.projectiles.extend(layer)
+
+
+def _storm(game, rng, tick):
+    # blow holes in the city for the first 60 ticks, then let it collapse
+    if tick >= 60:
+        return
+    width, height = game.resolution
+    for i in range(20):
+        game.buildings.destroy_circle((rng.uniform(0, width),
+                                       rng.uniform(height - 100, height)),
+                                      rng.uniform(5, 30))
+
+
+def _darken(game, rng, tick):
+    game.background.darken()
+
+
+SCENARIOS = collections.OrderedDict((s.name, s) for s in [
+    Scenario("steady", 1000,
+             "auto mode with the normal spawn rate"),
+    Scenario("barrage", 300,
+             "1000 missiles arrive at once", setup=_barrage),
+    Scenario("chain", 300,
+             "a layer of missiles over the city goes up in a chain reaction",
+             setup=_chain),
+    Scenario("storm", 300,
+             "destroy_circle storms, then heavy collapse", each_tick=_storm),
+    Scenario("darken", 1000,
+             "the sky darkens every tick", each_tick=_darken),
+])
@@ -0,0 +1,78 @@
+"""
+    Missile Defence Game
+    Uniform-grid broadphase for projectile collisions.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import math
+import numpy
+
+# cell coordinates are offset so that keys are never negative
+_CELL_OFFSET = 1 << 20
+_KEY_STRIDE  = 1 << 21
+
+
+class UniformGrid(object):
+    """Buckets points into square cells so that pairs of points that might
+    be near each other can be found without testing every pair.
+
+    rebuild() assigns cells and sorts the points by cell once per tick;
+    candidate_pairs() then returns every pair of points in nearby cells
+    as two index arrays.
+    """
+    def __init__(self, cell_size=50):
+        self.cell_size   = cell_size
+        self.cells       = numpy.zeros((0, 2), numpy.int64)
+        self.order       = numpy.zeros(0, numpy.int64)
+        self.sorted_keys = numpy.zeros(0, numpy.int64)
+
+    def _keys(self, cells):
+        return ((cells[:, 0] + _CELL_OFFSET) * _KEY_STRIDE +
+                (cells[:, 1] + _CELL_OFFSET))
+
+    def rebuild(self, positions):
+        self.cells = numpy.floor(numpy.asarray(positions) /
+                                 float(self.cell_size)).astype(numpy.int64)
+        keys = self._keys(self.cells)
+        self.order       = numpy.argsort(keys, kind="mergesort")
+        self.sorted_keys = keys[self.order]
+
+    def candidate_pairs(self, reach):
+        """All pairs (i, j), i != j, of points whose cells are close enough
+        that the points could be within reach of each other.
+
+        Each unordered pair is returned both ways round.
+        """
+        count = len(self.cells)
+        cell_reach = max(1, int(math.ceil(reach / float(self.cell_size))))
+
+        firsts  = []
+        seconds = []
+        for x_diff in range(-cell_reach, cell_reach + 1):
+            for y_diff in range(-cell_reach, cell_reach + 1):
+                keys = self._keys(self.cells + (x_diff, y_diff))
+                lo = numpy.searchsorted(self.sorted_keys, keys, "left")
+                hi = numpy.searchsorted(self.sorted_keys, keys, "right")
+                matches = hi - lo
+                total   = matches.sum()
+                if total == 0:
+                    continue
+
+                # expand each [lo, hi) range into indices of sorted points
+                starts = numpy.cumsum(matches) - matches
+                ranks  = (numpy.arange(total) -
+                          numpy.repeat(starts, matches) +
+                          numpy.repeat(lo, matches))
+                firsts.append(numpy.repeat(numpy.arange(count), matches))
+                seconds.append(self.order[ranks])
+
+        if not firsts:
+            empty = numpy.zeros(0, numpy.int64)
+            return empty, empty
+
+        first  = numpy.concatenate(firsts)
+        second = numpy.concatenate(seconds)
+        different = first != second
+        return first[different], second[different]
@@ -0,0 +1,212 @@
+"""
+    Missile Defence Game
+    Storage for the map of which pixels are buildings.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import collections
+
+import numpy
+
+
+class DenseMap(object):
+    """A map of solid pixels kept as one bool array, indexed [x, y].
+
+    Both kinds of map are used through the same region interface: read()
+    a box, change it and write() it back.
+    """
+    def __init__(self, solid):
+        self.size  = solid.shape
+        self.solid = solid
+
+    def read(self, x_min, x_max, y_min, y_max):
+        """The box [x_min, x_max) x [y_min, y_max) as a bool array. It may
+        be a view of the map, so write() it back after changing it."""
+        return self.solid[x_min:x_max, y_min:y_max]
+
+    def write(self, x_min, y_min, block):
+        self.solid[x_min:x_min + block.shape[0],
+                   y_min:y_min + block.shape[1]] = block
+
+    def blocks(self, x_min, x_max, y_min, y_max):
+        """(x, y, block) for the parts of the box that may have anything
+        solid in them; the rest is empty."""
+        yield (x_min, y_min, self.read(x_min, x_max, y_min, y_max))
+
+    def get(self, x, y):
+        return self.solid[x, y]
+
+    def lookup(self, xs, ys):
+        """Whether each of the points (xs[i], ys[i]) is solid."""
+        return self.solid[xs, ys]
+
+    def to_array(self):
+        return self.solid.copy()
+
+    def get_nbytes(self):
+        return self.solid.nbytes
+
+
+class TiledMap(object):
+    """A map of solid pixels split into tile_size square tiles, so that
+    memory and work go with the size of the city rather than the screen.
+
+    Tiles that are all sky or all solid take no storage: any_solid and
+    full say which they are. Other tiles are kept bit-packed, 8 pixels to
+    a byte. Tiles at the right and bottom edges may be smaller. The last
+    unpacked_limit tiles used are also kept unpacked, as the same few tiles
+    tend to be read and written tick after tick.
+    """
+    unpacked_limit = 64
+
+    def __init__(self, size, tile_size=64):
+        self.size      = size
+        self.tile_size = tile_size
+        grid = (-(-size[0] // tile_size), -(-size[1] // tile_size))
+        self.tiles     = {}  # (tile x, tile y) -> packed bits
+        self.any_solid = numpy.zeros(grid, bool)
+        self.full      = numpy.zeros(grid, bool)
+        self.unpacked  = collections.OrderedDict()
+
+    @classmethod
+    def from_array(cls, solid, tile_size=64, size=None, y_offset=0):
+        """A map of the given size (solid's shape by default) whose rows
+        from y_offset down are solid, all rows above being empty."""
+        tiled = cls(size or solid.shape, tile_size)
+        rows = numpy.flatnonzero(solid.any(axis=0))
+        if len(rows) == 0:
+            return tiled
+
+        # find the tiles with anything in them all at once, from the first
+        # row of tiles that has, then store only those
+        ty_min = (rows[0] + y_offset) // tile_size
+        x_starts = numpy.arange(0, solid.shape[0], tile_size)
+        y_starts = numpy.arange(ty_min * tile_size, tiled.size[1], tile_size)
+        y_starts = numpy.maximum(0, y_starts - y_offset)
+        any_solid = numpy.logical_or.reduceat(solid, x_starts, 0)
+        any_solid = numpy.logical_or.reduceat(any_solid, y_starts, 1)
+        for (tx, ty) in zip(*numpy.nonzero(any_solid)):
+            x0, x1, y0, y1 = tiled._tile_box(tx, ty_min + ty)
+            top  = max(y0, y_offset)
+            tile = numpy.zeros((x1 - x0, y1 - y0), bool)
+            tile[:, top - y0:] = solid[x0:x1, top - y_offset:y1 - y_offset]
+            tiled._store(tx, ty_min + ty, tile)
+        return tiled
+
+    def _tile_box(self, tx, ty):
+        size = self.tile_size
+        x, y = tx * size, ty * size
+        return (x, min(x + size, self.size[0]), y, min(y + size, self.size[1]))
+
+    def _tile_range(self, x_min, x_max, y_min, y_max):
+        size = self.tile_size
+        return (x_min // size, -(-x_max // size),
+                y_min // size, -(-y_max // size))
+
+    def _unpack(self, tx, ty):
+        x0, x1, y0, y1 = self._tile_box(tx, ty)
+        if self.full[tx, ty]:
+            return numpy.ones((x1 - x0, y1 - y0), bool)
+        if not self.any_solid[tx, ty]:
+            return numpy.zeros((x1 - x0, y1 - y0), bool)
+
+        tile = self.unpacked.pop((tx, ty), None)
+        if tile is None:
+            bits = numpy.unpackbits(self.tiles[(tx, ty)])
+            tile = bits[:(x1 - x0) * (y1 - y0)].reshape(x1 - x0,
+                                                         y1 - y0).astype(bool)
+        self._remember(tx, ty, tile)
+        return tile
+
+    def _remember(self, tx, ty, tile):
+        self.unpacked[(tx, ty)] = tile
+        if len(self.unpacked) > self.unpacked_limit:
+            self.unpacked.popitem(last=False)
+
+    def _store(self, tx, ty, tile):
+        count = int(numpy.count_nonzero(tile))
+        self.any_solid[tx, ty] = count > 0
+        self.full[tx, ty]      = count == tile.size
+        if 0 < count < tile.size:
+            self.tiles[(tx, ty)] = numpy.packbits(tile)
+            self._remember(tx, ty, tile)
+        else:
+            self.tiles.pop((tx, ty), None)
+            self.unpacked.pop((tx, ty), None)
+
+    def read(self, x_min, x_max, y_min, y_max):
+        """The box [x_min, x_max) x [y_min, y_max) as a new bool array."""
+        box = numpy.zeros((x_max - x_min, y_max - y_min), bool)
+        for (x, y, block) in self.blocks(x_min, x_max, y_min, y_max):
+            box[x - x_min:x - x_min + block.shape[0],
+                y - y_min:y - y_min + block.shape[1]] = block
+        return box
+
+    def write(self, x_min, y_min, block):
+        x_max = x_min + block.shape[0]
+        y_max = y_min + block.shape[1]
+        tx0, tx1, ty0, ty1 = self._tile_range(x_min, x_max, y_min, y_max)
+        for tx in range(tx0, tx1):
+            for ty in range(ty0, ty1):
+                x0, x1, y0, y1 = self._tile_box(tx, ty)
+                bx0, bx1 = max(x0, x_min), min(x1, x_max)
+                by0, by1 = max(y0, y_min), min(y1, y_max)
+                part = block[bx0 - x_min:bx1 - x_min, by0 - y_min:by1 - y_min]
+
+                # leave alone tiles that wouldn't change
+                if not self.any_solid[tx, ty] and not part.any():
+                    continue
+                if self.full[tx, ty] and part.all():
+                    continue
+
+                tile = self._unpack(tx, ty)
+                tile[bx0 - x0:bx1 - x0, by0 - y0:by1 - y0] = part
+                self._store(tx, ty, tile)
+
+    def blocks(self, x_min, x_max, y_min, y_max):
+        """(x, y, block) for the parts of the box in tiles with anything
+        solid in them; the rest is empty."""
+        tx0, tx1, ty0, ty1 = self._tile_range(x_min, x_max, y_min, y_max)
+        for (i, j) in zip(*numpy.nonzero(self.any_solid[tx0:tx1, ty0:ty1])):
+            tx, ty = tx0 + i, ty0 + j
+            x0, x1, y0, y1 = self._tile_box(tx, ty)
+            bx0, bx1 = max(x0, x_min), min(x1, x_max)
+            by0, by1 = max(y0, y_min), min(y1, y_max)
+            tile = self._unpack(tx, ty)
+            yield (bx0, by0, tile[bx0 - x0:bx1 - x0, by0 - y0:by1 - y0])
+
+    def get(self, x, y):
+        size = self.tile_size
+        tx, ty = x // size, y // size
+        if self.full[tx, ty]:
+            return True
+        if not self.any_solid[tx, ty]:
+            return False
+        x0, x1, y0, y1 = self._tile_box(tx, ty)
+        index = (x - x0) * (y1 - y0) + (y - y0)
+        return bool(self.tiles[(tx, ty)][index >> 3] & (0x80 >> (index & 7)))
+
+    def lookup(self, xs, ys):
+        """Whether each of the points (xs[i], ys[i]) is solid."""
+        size = self.tile_size
+        txs, tys = xs // size, ys // size
+        result = self.full[txs, tys]
+        partial = self.any_solid[txs, tys] & ~result
+        if partial.any():
+            for (tx, ty) in set(zip(txs[partial].tolist(),
+                                    tys[partial].tolist())):
+                here = partial & (txs == tx) & (tys == ty)
+                tile = self._unpack(tx, ty)
+                result[here] = tile[xs[here] - tx * size,
+                                    ys[here] - ty * size]
+        return result
+
+    def to_array(self):
+        return self.read(0, self.size[0], 0, self.size[1])
+
+    def get_nbytes(self):
+        """Bytes used by the map, not counting the unpacked tiles."""
+        return (sum(bits.nbytes for bits in self.tiles.values()) +
+                self.any_solid.nbytes + self.full.nbytes)
@@ -7,38 +7,44 @@
 """
 
 import numpy
-from random import uniform
+import math
+import random
 
-def generate_city(resolution):
+from buildingmap import DenseMap, TiledMap
+from profiling import NullProfiler
+
+def generate_city(resolution, rng=random):
+    """Make a random city; rng is anything with a uniform() method, such
+    as a random.Random."""
     # create a byte array for buildings info
     # we will use 0 for empty, 1 for present
     pixeldata = numpy.zeros(resolution, numpy.int8)
 
     x = 100
     while x < resolution[0] - 120:
-        gap = int(uniform(0, 5))
+        gap = int(rng.uniform(0, 5))
         x += gap
     
-        width  = int(uniform(5, 20))
-        height = int(uniform(10, 18))
+        width  = int(rng.uniform(5, 20))
+        height = int(rng.uniform(10, 18))
         add_building(pixeldata, x + (width / 2), width, height)   
 
     x = 120
     while x < resolution[0] - 180:
-        gap = int(uniform(5, 20))
+        gap = int(rng.uniform(5, 20))
         x += gap
     
-        width  = int(uniform(10, 40))
-        height = int(uniform(20, 50))            
+        width  = int(rng.uniform(10, 40))
+        height = int(rng.uniform(20, 50))            
         add_building(pixeldata, x + (width / 2), width, height)   
 
     x = 160
     while x < resolution[0] - 220:
-        gap = int(uniform(30, 125))
+        gap = int(rng.uniform(30, 125))
         x += gap
     
-        width  = int(uniform(8, 20))
-        height = int(uniform(70, 90))
+        width  = int(rng.uniform(8, 20))
+        height = int(rng.uniform(70, 90))
         add_building(pixeldata, x + (width / 2), width, height)   
         
     # add support for the cannon
@@ -48,71 +54,309 @@ def generate_city(resolution):
     
 def add_building(pixeldata, x_mid, width, height):
     # todo: add windows
-    resolution = numpy.ma.shape(pixeldata)
-    for x in range(x_mid - (width/2), x_mid + (width/2)):
-        for y in range(resolution[1] - height, resolution[1]):
-            try:
-                pixeldata[x][y] = 1
-            except IndexError:
-                pass
+    resolution = pixeldata.shape
+    x_min = max(0, x_mid - (width/2))
+    x_max = min(resolution[0], x_mid + (width/2))
+    if x_min < x_max:
+        pixeldata[x_min:x_max, max(0, resolution[1] - height):] = 1
 
 class Buildings(object):
-    def __init__(self, pixeldata, resolution):
-        self.dirty_set  = set()
-        self.pixeldata  = pixeldata
+    """The city, made from the pixeldata of generate_city, or just its
+    rows from y_offset down (the rest of the screen being empty).
+    
+    The pixels are kept in a TiledMap of tile_size tiles, or in a
+    DenseMap if tile_size is None.
+    """
+    def __init__(self, pixeldata, resolution, falling_animation=True,
+                 tile_size=64, y_offset=0):
+        solid = numpy.asarray(pixeldata, bool)
+        if tile_size is None:
+            dense = numpy.zeros(resolution, bool)
+            dense[:, y_offset:] = solid
+            self.map = DenseMap(dense)
+        else:
+            self.map = TiledMap.from_array(solid, tile_size, tuple(resolution),
+                                           y_offset)
         self.resolution = resolution
+        
+        # if set, unsupported pixels fall one pixel per tick, otherwise
+        # they land in the tick after the damage
+        self.falling_animation = falling_animation
+        
+        # columns that may have runs of pixels with nothing underneath
+        self.unsettled  = numpy.zeros(resolution[0], bool)
+        
+        # (x, y, width, height) boxes changed since they were last drawn;
+        # to start with that's the whole city
+        self.modified_rects = [(0, 0, resolution[0], resolution[1])]
+        
+        # the skyline: the y of the topmost solid pixel in each column
+        # (the screen height if there are none), and the highest of them.
+        # Nothing above it can touch a building.
+        self.skyline     = numpy.empty(resolution[0], int)
+        self.skyline_top = resolution[1]
+        self._update_skyline(numpy.arange(resolution[0]), solid, y_offset)
+        
+        # live occupancy: pixels per column and in total
+        self.column_counts = solid[:, self.skyline_top - y_offset:].sum(axis=1)
+        self.total         = int(self.column_counts.sum())
+        self.initial_column_counts = self.column_counts.copy()
+        self.initial_total         = self.total
+        
+        # the game swaps in a real Profiler when profiling is on
+        self.profiler = NullProfiler()
+
+    def add_building(self, x_mid, width, height):
+        x_min = max(0, x_mid - (width/2))
+        x_max = max(x_min, min(self.resolution[0], x_mid + (width/2)))
+        y_min = max(0, self.resolution[1] - height)
+        y_max = self.resolution[1]
+        if x_min >= x_max or y_min >= y_max:
+            return
+            
+        new = ~self.map.read(x_min, x_max, y_min, y_max)
+        self.map.write(x_min, y_min, numpy.ones(new.shape, bool))
+        self.mark_modified(x_min, y_min, x_max, y_max)
+        
+        added = new.sum(axis=1)
+        self.column_counts[x_min:x_max] += added
+        self.total += int(added.sum())
+        self.skyline[x_min:x_max] = numpy.minimum(self.skyline[x_min:x_max],
+                                                  y_min)
+        self.skyline_top = int(self.skyline.min())
+        
+    def _update_skyline(self, columns, solid, y_offset=0):
+        """Recompute the skyline of the given columns from solid, which
+        says which of their pixels from y_offset down are solid."""
+        self.skyline[columns] = numpy.where(solid.any(axis=1),
+                                            solid.argmax(axis=1) + y_offset,
+                                            self.resolution[1])
+        self.skyline_top = int(self.skyline.min())
+        
+    def _read_columns(self, columns, y_min):
+        """The pixels of the given columns (in increasing order) from y_min
+        down, and the box they were read from: (pixels, x_min, box)."""
+        x_min = columns[0]
+        box = self.map.read(x_min, columns[-1] + 1, y_min, self.resolution[1])
+        return box[columns - x_min], x_min, box
+        
+    def get_district_damage(self, districts):
+        """Fraction of the original buildings destroyed in each of the given
+        number of equal-width districts, from left to right."""
+        damage = []
+        for (now, initial) in zip(
+                numpy.array_split(self.column_counts, districts),
+                numpy.array_split(self.initial_column_counts, districts)):
+            if initial.sum() == 0:
+                damage.append(0.0)
+            else:
+                damage.append(1.0 - float(now.sum()) / initial.sum())
+        return damage
 
     def get(self, x, y):
+        if y < self.skyline_top:
+            return 0
         x, y = int(x), int(y)
-        if x < 0 or y < 0:
+        if (x < 0 or x >= self.resolution[0] or y < self.skyline[x] or
+                y >= self.resolution[1]):
             return 0
+        return int(self.map.get(x, y))
+        
+    def above_skyline(self, start, displacement):
+        """Whether the segment from start to start + displacement is sure
+        to miss the buildings, judging by the skyline alone."""
+        y_max = max(start[1], start[1] + displacement[1])
+        if y_max < self.skyline_top:
+            return True
+        x_min = max(0, int(min(start[0], start[0] + displacement[0])))
+        x_max = min(self.resolution[0],
+                    int(max(start[0], start[0] + displacement[0])) + 1)
+        return (x_min >= x_max or
+                int(y_max) < self.skyline[x_min:x_max].min())
             
-        try:
-            return self.pixeldata[x][y]
-        except IndexError:
-            return 0
+    def first_hit_time(self, start, displacement):
+        """Earliest time t in [0, 1] at which start + t * displacement is
+        inside a building, or None. The path is sampled at least once per
+        pixel so that fast projectiles can't skip through thin walls."""
+        if self.above_skyline(start, displacement):
+            return None
+            
+        steps = max(1, int(math.ceil(max(abs(displacement[0]),
+                                          abs(displacement[1])))))
+        ts = numpy.arange(steps + 1) / float(steps)
+        xs = (start[0] + ts * displacement[0]).astype(int)
+        ys = (start[1] + ts * displacement[1]).astype(int)
+        
+        inside = ((xs >= 0) & (ys >= 0) &
+                  (xs < self.resolution[0]) & (ys < self.resolution[1]))
+        inside[inside] = ys[inside] >= self.skyline[xs[inside]]
+        hits = numpy.zeros(len(ts), bool)
+        hits[inside] = self.map.lookup(xs[inside], ys[inside])
+        if not hits.any():
+            return None
+        return ts[hits.argmax()]
                 
-    def destroy_circle(self, position, radius):        
+    def destroy_circle(self, position, radius, inner_radius=None):
+        """Destroy buildings within radius of position.
+        
+        Pixels within inner_radius are taken to have been destroyed
+        already (by a smaller blast at the same position) and are skipped,
+        so a growing explosion only needs to process the new annulus.
+        
+        Returns the x and y coordinates of the destroyed pixels as arrays.
+        """
+        with self.profiler.phase("destruction"):
+            xs, ys = self._destroy_circle(position, radius, inner_radius)
+        self.profiler.count("destroyed pixels", len(xs))
+        return xs, ys
+        
+    def _destroy_circle(self, position, radius, inner_radius):
         x_min = max(0, int(position[0] - radius))
         x_max = min(self.resolution[0], int(position[0] + radius + 1))
         y_min = max(0, int(position[1] - radius))
         y_max = min(self.resolution[1], int(position[1] + radius + 1))
         
+        # there is nothing to destroy above the skyline
+        if x_min < x_max:
+            y_min = max(y_min, int(self.skyline[x_min:x_max].min()))
+        if x_min >= x_max or y_min >= y_max:
+            return numpy.zeros(0, int), numpy.zeros(0, int)
+        
         radius_squared = int(radius * radius)
         
+        dist_x = position[0] - numpy.arange(x_min, x_max)
+        dist_y = position[1] - numpy.arange(y_min, y_max)
+        dist_squared = dist_x[:, numpy.newaxis] ** 2 + dist_y ** 2
+        
+        in_blast = dist_squared < radius_squared
+        if inner_radius is not None:
+            in_blast &= dist_squared >= int(inner_radius * inner_radius)
+        
         # destroy buildings in the blast radius
-        for x in range(x_min, x_max):
-            for y in range(y_min, y_max):            
-                dist_x = position[0] - x
-                dist_y = position[1] - y
-                if dist_x * dist_x + dist_y * dist_y < radius_squared:
-                    if self.pixeldata[x][y] == 1:
-                        self.pixeldata[x][y] = 0
-                        self.dirty_set.add((x,y))
+        region    = self.map.read(x_min, x_max, y_min, y_max)
+        destroyed = in_blast & region
+        if not destroyed.any():
+            return numpy.zeros(0, int), numpy.zeros(0, int)
+        region[destroyed] = False
+        self.map.write(x_min, y_min, region)
+        
+        self.unsettled[x_min:x_max] |= destroyed.any(axis=1)
+        
+        # destruction only moves the skyline where it took the top pixel
+        tops = self.skyline[x_min:x_max] - y_min
+        in_region = numpy.flatnonzero((tops >= 0) & (tops < y_max - y_min))
+        lowered = in_region[destroyed[in_region, tops[in_region]]]
+        if len(lowered) > 0:
+            columns = lowered + x_min
+            y_top = int(self.skyline[columns].min())
+            self._update_skyline(columns,
+                                 self._read_columns(columns, y_top)[0], y_top)
+        
+        lost = destroyed.sum(axis=1)
+        self.column_counts[x_min:x_max] -= lost
+        self.total -= int(lost.sum())
+        
+        xs, ys = numpy.nonzero(destroyed)
+        xs += x_min
+        ys += y_min
+        if len(xs) > 0:
+            self.mark_modified(xs.min(), ys.min(), xs.max() + 1, ys.max() + 1)
+        return xs, ys
                         
     def apply_physics(self):
-        ignore_set = set()
-        new_dirty_set = set()
-        
-        for (x,y) in self.dirty_set:
-            assert x >=0 and y >=0 and type(x) == type(1) and type(y) == type(1)             
-            assert self.pixeldata[x][y] == 0
-                            
-            if (x,y) in ignore_set:
-                new_dirty_set.add((x,y))
-            else:
-                y2 = y - 1
-                any_falling = False
-                while y2 > 0 and self.pixeldata[x][y2] == 1:
-                    y2 -= 1
-                    any_falling = True
-                
-                if any_falling:
-                    self.pixeldata[x][y2 + 1] = 0
-                    self.pixeldata[x][y] = 1
-                    assert (x,y) not in new_dirty_set
-                    if y + 1 < self.resolution[1] and self.pixeldata[x][y + 1] == 0:
-                        new_dirty_set.add((x, y + 1))
-                        ignore_set.add((x, y + 1)) # don't want it falling any further
-        self.dirty_set = new_dirty_set
-
+        with self.profiler.phase("collapse"):
+            self._collapse()
+            
+    def _collapse(self):
+        columns = numpy.flatnonzero(self.unsettled)
+        if len(columns) == 0:
+            return
+        
+        # pixels only fall, so only rows from the skyline down can change
+        y_top = int(self.skyline[columns].min())
+        if y_top >= self.resolution[1]:
+            self.unsettled[columns] = False
+            return
+        before, x_min, box = self._read_columns(columns, y_top)
+        solid = before.copy()
+        if self.falling_animation:
+            falling = self._drop_runs_one_pixel(solid)
+        else:
+            falling = self._drop_runs_to_ground(solid)
+            
+        # pixels only move within their column, so the counts don't change
+        box[columns - x_min] = solid
+        self.map.write(x_min, y_top, box)
+        self.unsettled[columns] = falling
+        self._update_skyline(columns, solid, y_top)
+        self._mark_columns_modified(columns, before != solid, y_top)
+        
+    def _mark_columns_modified(self, columns, changed, y_offset=0):
+        """Record boxes around the changed pixels of the given columns
+        (from y_offset down), one box per run of neighbouring columns."""
+        changed_columns = changed.any(axis=1)
+        columns = columns[changed_columns]
+        changed = changed[changed_columns]
+        if len(columns) == 0:
+            return
+            
+        height = changed.shape[1]
+        tops    = changed.argmax(axis=1) + y_offset
+        bottoms = height - changed[:, ::-1].argmax(axis=1) + y_offset
+        
+        breaks = numpy.flatnonzero(numpy.diff(columns) > 1) + 1
+        for (run, run_tops, run_bottoms) in zip(numpy.split(columns, breaks),
+                                                numpy.split(tops, breaks),
+                                                numpy.split(bottoms, breaks)):
+            self.mark_modified(run[0], run_tops.min(),
+                               run[-1] + 1, run_bottoms.max())
+            
+    def mark_modified(self, x_min, y_min, x_max, y_max):
+        self.modified_rects.append((int(x_min), int(y_min),
+                                    int(x_max - x_min), int(y_max - y_min)))
+                                    
+        # nobody is collecting them (e.g. headless): keep one bounding box
+        if len(self.modified_rects) > 256:
+            xs = [x for (x, y, w, h) in self.modified_rects]
+            ys = [y for (x, y, w, h) in self.modified_rects]
+            x_ends = [x + w for (x, y, w, h) in self.modified_rects]
+            y_ends = [y + h for (x, y, w, h) in self.modified_rects]
+            self.modified_rects = [(min(xs), min(ys),
+                                    max(x_ends) - min(xs),
+                                    max(y_ends) - min(ys))]
+        
+    def take_modified_rects(self):
+        """The (x, y, width, height) boxes of the map changed since the
+        last call."""
+        rects = self.modified_rects
+        self.modified_rects = []
+        return rects
+        
+    def _drop_runs_one_pixel(self, solid):
+        """Move every unsupported run of pixels in the given columns down by
+        one pixel. Returns which columns had anything falling."""
+        above = numpy.zeros_like(solid)
+        above[:, 1:] = solid[:, :-1]
+        below = numpy.zeros_like(solid)
+        below[:, :-1] = solid[:, 1:]
+        
+        # runs are found in column order, so tops and ends pair up
+        top_cols, top_ys = numpy.nonzero(solid & ~above)
+        end_cols, end_ys = numpy.nonzero(solid & ~below)
+        
+        # a run is unsupported unless it ends on the ground
+        falling = end_ys < solid.shape[1] - 1
+        solid[top_cols[falling], top_ys[falling]] = False
+        solid[end_cols[falling], end_ys[falling] + 1] = True
+        
+        falling_columns = numpy.zeros(len(solid), bool)
+        falling_columns[end_cols[falling]] = True
+        return falling_columns
+    
+    def _drop_runs_to_ground(self, solid):
+        """Drop every run of pixels in the given columns straight onto the
+        ground. Returns which columns still have anything falling (none)."""
+        heights = solid.sum(axis=1)
+        solid[...] = (numpy.arange(solid.shape[1]) >=
+                      solid.shape[1] - heights[:, numpy.newaxis])
+        return numpy.zeros(len(solid), bool)
@@ -0,0 +1,39 @@
+"""
+    Missile Defence Game
+    Files kept between runs to make starting up faster.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import os
+import tempfile
+
+
+def get_cache_dir():
+    """Where to keep cached files, following the XDG convention."""
+    base = os.environ.get("XDG_CACHE_HOME",
+                          os.path.join(os.path.expanduser("~"), ".cache"))
+    return os.path.join(base, "missile-defence")
+
+
+def save_atomically(path, write, mode="wb"):
+    """Make the file at path by calling write(f) on a temporary file that
+    is then renamed into place, so other processes never see half a file.
+    The directory is made if need be. Raises IOError or OSError if the
+    file can't be written."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.rename(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
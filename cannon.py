@@ -10,24 +10,45 @@ from numpy import array
 import pygame
 from maths import normalize
 import math
+import random
 import projectiles
 
 class CannonMissile(projectiles.Missile):
-    def __init__(self, centre, velocity):
-        projectiles.Missile.__init__(self, centre, velocity)
+    __slots__ = ()
+    
+    default_blast_radius = 20
+    colour_front   = (100, 120, 200)
+    blast_colour_a = (150, 180, 255)
+    blast_colour_b = (50, 60, 200)
+    
+    def __init__(self, centre, velocity, rng=random):
+        projectiles.Missile.__init__(self, centre, velocity, rng)
         self.size_increase_remaining = 30
         
         self.draw_radius    = 0
-        self.blast_radius   = 20
+        self.blast_radius   = self.default_blast_radius
         self.blast_ticks    = 12
-        self.blast_colour_a = (150, 180, 255)
-        self.blast_colour_b = (50, 60, 200)
         self.radius         = 0
-        self.colour_front   = (100, 120, 200)
         self.invulnerable_ticks = 6
         self.cannon_fire    = 1
+        
+class CannonExplosion(projectiles.Missile):
+    """The cannon going up when it loses its support."""
+    __slots__ = ()
+    
+    blast_colour_a = (100, 200, 150)
+    blast_colour_b = (20, 50, 20)
+    
+    def __init__(self, centre, blast_radius, rng=random):
+        projectiles.Missile.__init__(self, centre, (0, 0), rng)
+        self.exploding    = True
+        self.blast_radius = blast_radius
+        self.blast_ticks  = 30
                 
 class DefenceCannon(object):
+    missile_speed = 20
+    spread        = (-0.08, 0, 0.08)  # angles of the three missiles fired
+    
     def __init__(self, centre, game):
         self.target = array([100, -100])
         self.centre = array(centre)
@@ -43,12 +64,8 @@ class DefenceCannon(object):
         if not self.destroyed:
             if not self.game.buildings.get(self.centre[0], self.centre[1]):
                 self.destroyed = True            
-                explosion = projectiles.Missile(self.centre, (0, 0))
-                explosion.exploding = True
-                explosion.blast_colour_a = (100, 200, 150)
-                explosion.blast_colour_b = (20, 50, 20) 
-                explosion.blast_radius = self.length
-                explosion.blast_ticks = 30 
+                explosion = CannonExplosion(self.centre, self.length,
+                                            self.game.random)
                 self.game.projectiles.append(explosion)
     
     def update_direction(self):
@@ -61,6 +78,11 @@ class DefenceCannon(object):
             if self.direction[0] == 0:
                 self.direction[0] = -1
                     
+    def get_draw_rect(self):
+        reach = self.length + 4
+        return pygame.Rect(self.centre[0] - reach, self.centre[1] - reach,
+                           reach * 2 + 1, reach * 2 + 1)
+        
     def draw(self, surface):
         if not self.destroyed:
             self.update_direction()
@@ -80,7 +102,8 @@ class DefenceCannon(object):
 
     def create_missile(self, missile_velocity):
         new_missile = CannonMissile(self.centre,
-                                          missile_velocity)
+                                    missile_velocity,
+                                    self.game.random)
                                                 
         self.game.projectiles.append(new_missile)
                            
@@ -89,8 +112,8 @@ class DefenceCannon(object):
             self.target = target
             self.update_direction()
             self.ticks_since_firing = 0
-            missile_velocity = array(self.direction) * 20
-            for theta in [-0.08, 0, 0.08]:
+            missile_velocity = array(self.direction) * self.missile_speed
+            for theta in self.spread:
                 cos_theta = math.cos(theta)
                 sin_theta = math.sin(theta)
                 self.create_missile((missile_velocity[0] * cos_theta -
@@ -0,0 +1,75 @@
+"""
+    Missile Defence Game
+    On-disk cache of pre-generated cities.
+
+    Each game picks one of pool_size cities for its resolution, so the
+    same few cities are made again and again. They are generated once,
+    saved as .npy files and memory-mapped back in, which makes a reset
+    much cheaper (batch runs do thousands).
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import os
+import random
+
+import numpy
+
+from buildings import generate_city
+from cachefiles import save_atomically
+
+# rows at the bottom of the screen a city can reach; only these are kept
+CITY_HEIGHT = 100
+
+# bump when generate_city changes, so old files are not used
+FORMAT = 1
+
+
+class CityCache(object):
+    """Cities for any resolution, city i being generate_city() seeded with
+    i. With directory set they are stored under it; if it can't be
+    written to they are just generated each time, which gives the same
+    cities more slowly."""
+    pool_size = 64
+
+    def __init__(self, directory=None):
+        self.directory = directory
+        self.loaded    = {}  # (resolution, index) -> copy-on-write memmap
+
+    def get(self, resolution, rng):
+        """A city for the resolution chosen with rng, as (pixeldata,
+        y_offset) for Buildings: the bool pixels of the rows from y_offset
+        down, above which there is nothing. Don't change the pixeldata."""
+        resolution = tuple(resolution)
+        index = rng.randrange(self.pool_size)
+        band  = self.loaded.get((resolution, index))
+        if band is None:
+            band = self._load(resolution, index)
+        return band, resolution[1] - band.shape[1]
+
+    def _generate(self, resolution, index):
+        city = generate_city(resolution, random.Random(index))
+        return city[:, max(0, resolution[1] - CITY_HEIGHT):] == 1
+
+    def _path(self, resolution, index):
+        return os.path.join(self.directory,
+                            "cities-%d-%dx%d" % ((FORMAT,) + resolution),
+                            "%d.npy" % index)
+
+    def _load(self, resolution, index):
+        if self.directory is None:
+            return self._generate(resolution, index)
+
+        path = self._path(resolution, index)
+        try:
+            # copy-on-write, so the file is never changed through it
+            band = numpy.load(path, mmap_mode="c")
+        except (IOError, ValueError):
+            band = self._generate(resolution, index)
+            try:
+                save_atomically(path, lambda f: numpy.save(f, band))
+            except (IOError, OSError):
+                return band
+        self.loaded[(resolution, index)] = band
+        return band
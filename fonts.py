@@ -0,0 +1,70 @@
+"""
+    Missile Defence Game
+    Finding fonts quickly.
+
+    pygame.font.match_font scans the system's fonts (running fc-list on
+    Linux), which can take a good part of a second, and falling back to
+    Font(None) imports pkg_resources. Both are avoided after the first
+    run by remembering the paths found in the cache directory.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import json
+import os
+
+import pygame
+import pygame.font
+
+from cachefiles import save_atomically
+
+CACHE_FILE = "fonts.json"
+
+
+def get_default_font():
+    """The path of the font that comes with pygame."""
+    return os.path.join(os.path.dirname(pygame.__file__),
+                        pygame.font.get_default_font())
+
+
+class FontFinder(object):
+    """Finds the paths of system fonts by name, as match_font does, using
+    pygame's own font if there is no match. With cache_dir set, what it
+    finds is remembered there for next time."""
+    def __init__(self, cache_dir=None):
+        self.path  = None
+        self.paths = {}
+        if cache_dir is not None:
+            self.path = os.path.join(cache_dir, CACHE_FILE)
+            try:
+                with open(self.path) as f:
+                    self.paths = json.load(f)
+            except (IOError, ValueError):
+                pass
+
+    def find(self, name, bold=False):
+        key  = "%s%s" % (name, " bold" if bold else "")
+        path = self.paths.get(key)
+        if path is not None and os.path.exists(path):
+            return path
+
+        path = pygame.font.match_font(name, bold) or get_default_font()
+        self.paths[key] = path
+        self._save()
+        return path
+
+    def load(self, name, size, bold=False):
+        """The named font at the given size."""
+        return pygame.font.Font(self.find(name, bold), size)
+
+    def _save(self):
+        if self.path is None:
+            return
+        # renamed into place, so games starting at the same time never
+        # read half a file
+        try:
+            save_atomically(self.path, lambda f: json.dump(self.paths, f),
+                            "w")
+        except (IOError, OSError):
+            pass
@@ -20,3 +20,41 @@ def normalize(a):
         b = a / size
         return b
 
+
+def swept_circle_time(start, displacement, centre, radius):
+    """Earliest time t in [0, 1] at which the point start + t * displacement
+    is within radius of centre, or None if it never is."""
+    rx = start[0] - centre[0]
+    ry = start[1] - centre[1]
+    c  = rx * rx + ry * ry - radius * radius
+    if c <= 0:
+        return 0.0
+        
+    a = displacement[0] * displacement[0] + displacement[1] * displacement[1]
+    b = rx * displacement[0] + ry * displacement[1]
+    if a == 0 or b >= 0:
+        return None  # not moving, or moving away
+        
+    discriminant = b * b - a * c
+    if discriminant < 0:
+        return None
+        
+    t = (-b - math.sqrt(discriminant)) / a
+    if t > 1:
+        return None
+    return t
+
+def swept_circle_times(starts, displacements, centres, radii):
+    """swept_circle_time for arrays of starts, displacements and centres
+    (one per row) and radii. Returns NaN where there is no contact."""
+    rel = starts - centres
+    a   = (displacements * displacements).sum(axis=1)
+    b   = (rel * displacements).sum(axis=1)
+    c   = (rel * rel).sum(axis=1) - radii * radii
+    discriminant = b * b - a * c
+    
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        t = (-b - numpy.sqrt(discriminant)) / a
+        t[(a == 0) | (b >= 0) | (discriminant < 0) | (t > 1)] = numpy.nan
+    t[c <= 0] = 0.0
+    return t
@@ -10,24 +10,39 @@
 import pygame
 import pygame.font
 
-import collections
-
 import numpy
 from   numpy import array
 
 import math
-from maths import size_squared, normalize
+from maths import swept_circle_time, swept_circle_times
 
 import random
-from random import uniform
+
+import argparse
+import hashlib
+import os
+import Queue
+import threading
+import timeit
 
 
 # imports from my files
 import background
+import profiling
 import projectiles
+import replay
+import trajectory
 from background import grad
-from cannon import DefenceCannon
-from buildings import Buildings, generate_city
+from cannon import DefenceCannon, CannonMissile
+from cachefiles import get_cache_dir
+from citycache import CityCache
+from fonts import FontFinder
+from buildings import Buildings
+from broadphase import UniformGrid
+from rendering import DirtyRectRenderer
+from simulation import SimulationThread
+from sprites import SpriteCache
+from targeting import InterceptSolver
 
 
 class Physics(object):
@@ -36,153 +51,342 @@ class Physics(object):
     gravity        = 0.05
     wind           = 0.0
     
-    def __init__(self, game):
+    def __init__(self, game, cell_size=50):
         self.game = game
-        self.location_map = collections.defaultdict(list)
+        self.grid = UniformGrid(cell_size)
+        self.pairs_tested = 0
+        
+        # per projectile slot: earliest time of contact with another
+        # projectile this tick, and which one
+        self.contact_time = numpy.zeros(0)
+        self.contact_with = numpy.zeros(0, int)
+        
+    def find_contacts(self):
+        """Work out, for every projectile at once, the first other
+        projectile it touches along this tick's displacement."""
+        store = self.game.projectiles
+        count = len(store)
+        self.contact_time = numpy.empty(count)
+        self.contact_time.fill(numpy.inf)
+        self.contact_with = numpy.empty(count, int)
+        self.contact_with.fill(-1)
+        self.pairs_tested = 0
+        if count < 2:
+            return
             
-    def _get_adjacent_projectiles(self, position):
-        orig_cell = self._get_cell_for(position)
-        cells = []
-        for xdiff in [-1, 0, 1]:
-            for ydiff in [-1, 0, 1]:  
-                new_cell = ((orig_cell[0] + xdiff, orig_cell[1] + ydiff))
-                if new_cell in self.location_map:
-                    for p in self.location_map[new_cell]:
-                        yield p
-        
-    def _get_cell_for(self, position):
-        return tuple(int(x) / 50 for x in position)
-        
-    def update_location_cache(self):
-        self.location_map.clear()
-        for p in self.game.projectiles:
-            self.location_map[self._get_cell_for(p.position)].append(p)            
+        position    = store.column("position")
+        velocity    = store.column("velocity")
+        radius      = store.column("radius")
+        exploding   = store.column("exploding")
+        cannon_fire = store.column("cannon_fire")
+        
+        # furthest apart two projectiles can start and still touch
+        max_speed = math.sqrt((velocity * velocity).sum(axis=1).max())
+        reach     = 2 * numpy.abs(radius).max() + max_speed
+        
+        self.grid.rebuild(position)
+        first, second = self.grid.candidate_pairs(reach)
+        
+        # exploding projectiles don't move or check; cannon fire doesn't
+        # collide with other cannon fire
+        wanted = ~exploding[first] & ~(cannon_fire[first] & cannon_fire[second])
+        first  = first[wanted]
+        second = second[wanted]
+        self.pairs_tested = len(first)
+        
+        t = swept_circle_times(position[first], velocity[first],
+                               position[second],
+                               radius[first] + radius[second])
+        hit    = ~numpy.isnan(t)
+        first  = first[hit]
+        second = second[hit]
+        t      = t[hit]
+        
+        # keep the earliest contact for each projectile
+        order  = numpy.lexsort((t, first))
+        first  = first[order]
+        second = second[order]
+        t      = t[order]
+        earliest = numpy.ones(len(first), bool)
+        earliest[1:] = first[1:] != first[:-1]
+        self.contact_time[first[earliest]] = t[earliest]
+        self.contact_with[first[earliest]] = second[earliest]
     
-    def position_iterator(self, p):
-        count = 10
-        for x in range(0, count + 1):
-           yield array(p.position) + array(p.velocity) * (x / float(count))
-           
     def check_collision(self, p):
-        for pos in self.position_iterator(p):
-            if (not p.cannon_fire and
-                self.game.shield_dome.collision_check(p.position)):
+        """Sweep p along this tick's displacement (its velocity) and react
+        to the earliest thing it touches: the dome, a building or another
+        projectile."""
+        start = (float(p.position[0]), float(p.position[1]))
+        displacement = (float(p.velocity[0]), float(p.velocity[1]))
+        
+        hit_time = None
+        hit      = None
+        
+        if not p.cannon_fire:
+            t = self.game.shield_dome.intersect_time(start, displacement)
+            if t is not None:
+                hit_time, hit = t, self.game.shield_dome
                 
-                p.exploding = True
-                p.position = pos # don't hit inside
-                return
-
-            if self.game.buildings.get(pos[0], pos[1]) == 1:
-                p.exploding = True
-                p.position = pos # don't hit inside
-                return        
+        t = self.game.buildings.first_hit_time(start, displacement)
+        if t is not None and (hit_time is None or t < hit_time):
+            hit_time, hit = t, self.game.buildings
+            
+        # projectiles that aren't in the store (yet) have no contacts
+        if p._store is self.game.projectiles:
+            t = self.contact_time[p._slot]
+            if t < numpy.inf and (hit_time is None or t < hit_time):
+                hit_time = t
+                hit      = self.game.projectiles.objects[self.contact_with[p._slot]]
+                    
+        if hit is None:
+            return
+        elif hit is self.game.shield_dome or hit is self.game.buildings:
+            if hit is self.game.shield_dome:
+                self.game.shield_dome.register_hit()
+            p.exploding = True
+            p.position = (start[0] + displacement[0] * hit_time,
+                          start[1] + displacement[1] * hit_time) # don't hit inside
+        else:
+            q = hit
+            if not p.exploding and not p.cannon_fire:
+                self.game.score += 200                            
+            p.exploding = True
             
-            for q in self._get_adjacent_projectiles(pos):
-                if p is not q and (not p.cannon_fire or not q.cannon_fire):
-                    radius_sum = q.radius + p.radius
-                    radius_sum_sq = radius_sum * radius_sum            
-                    diff_vec = array(pos) - array(q.position)
-                    distance_squared = numpy.ma.innerproduct(diff_vec, diff_vec)
-                    if distance_squared <= radius_sum_sq:
-                        if not p.exploding and not p.cannon_fire:
-                            self.game.score += 200                            
-                        p.exploding = True
-                        
-                        if not q.exploding and not q.cannon_fire:
-                            self.game.score += 200                        
-                        q.exploding = True
-                        
-                        return
+            if not q.exploding and not q.cannon_fire:
+                self.game.score += 200                        
+            q.exploding = True
+
+def make_icon():
+    """The window icon: the dome over a city."""
+    icon = pygame.Surface((32, 32))
+    icon.fill((0, 0, 20))
+    pygame.draw.ellipse(icon, (255, 120, 255), ((2, 10), (28, 40)), 2)
+    icon.fill((0, 0, 10), ((8, 20), (16, 12)))
+    return icon
 
 class ShieldDome(object):
+    # how much memory the renderings of the dome (one per opacity, plus
+    # the flash) may take; at 4K each is nearly 9 MB
+    cache_bytes = 32 * 1024 * 1024
+    
+    edge_colour = (255, 120, 255)
+    
     def __init__(self, resolution):
         self.size       = (resolution[0] * 4 / 5, resolution[1] / 3)
         self.resolution = resolution
-        self.tmpsurface = pygame.Surface(self.resolution, flags=pygame.SRCALPHA)
         self.draw_rect  = (((self.resolution[0] - self.size[0]) / 2,
                             self.resolution[1] - self.size[1]),
                            ((self.resolution[0] + self.size[0]) / 2,
                             self.resolution[1] + self.size[1] * 2))
         self.bright = 0
         self.health = 10
-        self.draw_to_tmpsurface()
+        self.sprites = SpriteCache(max_bytes=self.cache_bytes)
         
-    def draw_to_tmpsurface(self):
-        opacity = 20 + self.health * 3
-        if opacity > 150:
-            opacity = 150
-
-        edge_colour = (255, 120, 255, opacity + self.bright)
+    def reset(self, health):
+        """Bring the dome back for a new game, keeping its sprites."""
+        self.bright = 0
+        self.health = health
+        
+    def render(self, edge_alpha, fill):
+        """The on-screen part of the dome, cropped to the ellipse's bounds
+        (the rest of the ellipse is below the bottom of the screen): an
+        edge of edge_colour at edge_alpha, filled with fill."""
+        sprite = pygame.Surface(self.get_screen_rect().size,
+                                flags=pygame.SRCALPHA)
         
-        pygame.draw.ellipse(self.tmpsurface, edge_colour,
+        pygame.draw.ellipse(sprite, self.edge_colour + (edge_alpha,),
                             ((0,0), (self.size[0], self.size[1] * 3)))
         border = 4
-        pygame.draw.ellipse(self.tmpsurface, (200, 50, 200, opacity),
+        pygame.draw.ellipse(sprite, fill,
                             ((border,border), (self.size[0]-border * 2,
                              self.size[1] * 3 - border * 2)))
+        
+        if pygame.display.get_surface() is not None:
+            sprite = sprite.convert_alpha()
+        return sprite
+        
+    def get_sprite(self):
+        opacity = self.get_opacity()
+        return self.sprites.get(opacity, lambda: self.render(
+            opacity, (200, 50, 200, opacity)))
+            
+    def get_flash_sprite(self):
+        """The edge on its own, to blend over the dome when it is hit. The
+        flash fades by blitting it with less surface alpha, so there is
+        only ever one of it."""
+        sprite = self.sprites.get("flash", lambda: self.render(
+            255, (0, 0, 0, 0)))
+        sprite.set_alpha(self.bright)
+        return sprite
     
     def is_online(self):
         return self.health > 0
         
+    def get_opacity(self):
+        return min(150, 20 + self.health * 3)
+        
+    def get_state(self):
+        """Everything that affects how the dome looks."""
+        if not self.is_online():
+            return None
+        return (self.get_opacity(), self.bright)
+
+    def get_screen_rect(self):
+        """The part of the screen the dome covers."""
+        return pygame.Rect(self.draw_rect[0],
+                           (self.size[0],
+                            self.resolution[1] - self.draw_rect[0][1]))
+        
+    def blit_area(self, surface, area):
+        """Draw the part of the dome inside the given screen rect."""
+        if self.is_online():
+            source = area.move(-self.draw_rect[0][0], -self.draw_rect[0][1])
+            surface.blit(self.get_sprite(), area.topleft, source)
+            if self.bright > 0:
+                surface.blit(self.get_flash_sprite(), area.topleft, source)
+                                   
+    def fade(self):
+        if self.bright > 0:
+            self.bright -= 1
+            
     def draw(self, surface):
         if self.is_online():
-            self.draw_to_tmpsurface()
-        
-            surface.blit(self.tmpsurface, self.draw_rect[0])
+            surface.blit(self.get_sprite(), self.draw_rect[0])
             if self.bright > 0:
-                self.bright -= 1
+                surface.blit(self.get_flash_sprite(), self.draw_rect[0])
         
-    def collision_check(self, (x,y)):
+    def intersect_time(self, start, displacement):
+        """Earliest time t in [0, 1] at which start + t * displacement is
+        inside the dome, or None."""
         if not self.is_online():
-            return False
-        else:
-            x_centre = (self.draw_rect[0][0] + self.draw_rect[1][0]) / 2
-            y_centre = (self.draw_rect[0][1] + self.draw_rect[1][1]) / 2
-            width    = (self.draw_rect[1][0] - self.draw_rect[0][0])
-            height   = (self.draw_rect[1][1] - self.draw_rect[0][1])
-
-            x_diff = (x - x_centre) / (width / 2)
-            y_diff = (y - y_centre) / (height / 2)
+            return None
             
-            hit = ((x_diff * x_diff) + (y_diff * y_diff)) <= 1
-            if hit:
-               self.bright += 30
-               if self.bright > 70: self.bright = 70
-               self.health -= 1
-               
-            return hit
+        x_centre = (self.draw_rect[0][0] + self.draw_rect[1][0]) / 2
+        y_centre = (self.draw_rect[0][1] + self.draw_rect[1][1]) / 2
+        width    = (self.draw_rect[1][0] - self.draw_rect[0][0])
+        height   = (self.draw_rect[1][1] - self.draw_rect[0][1])
+        
+        # squash the ellipse into a unit circle
+        x_scale = float(width / 2)
+        y_scale = float(height / 2)
+        return swept_circle_time(((start[0] - x_centre) / x_scale,
+                                  (start[1] - y_centre) / y_scale),
+                                 (displacement[0] / x_scale,
+                                  displacement[1] / y_scale),
+                                 (0, 0), 1)
+                                 
+    def register_hit(self):
+        self.bright += 30
+        if self.bright > 70: self.bright = 70
+        self.health -= 1
             
 class MissileDefenceGame(object):
     def reset(self):
-        self.background = background.StarryBackground(self.resolution)                       
+        # the background and dome are kept from one game to the next,
+        # along with what they have rendered
+        if self.background is None:
+            self.background = background.StarryBackground(self.resolution,
+                                                          self.random)
+            self.shield_dome = ShieldDome(self.resolution)
+        else:
+            self.background.new_sky(self.random)
+        self.shield_dome.reset(health=2)
         self.physics = Physics(self)        
         self.cannon = DefenceCannon(centre=(self.resolution[0] / 2,
                                             self.resolution[1] - 99),
                                     game=self)
-        self.buildings = Buildings(generate_city(self.resolution),
-                                   self.resolution)
+        city, city_top = self.cities.get(self.resolution, self.random)
+        self.buildings = Buildings(city, self.resolution,
+                                   tile_size=self.tile_size, y_offset=city_top)
+        self.buildings.profiler = self.profiler
         self.firing = False
         self.fire_cycle = 0
-        self.shield_dome = ShieldDome(self.resolution)
-        self.shield_dome.health = 2
+        self.targeting = InterceptSolver(self.physics, self.resolution,
+                                         speed=DefenceCannon.missile_speed,
+                                         spread=DefenceCannon.spread,
+                                         shot_reach=CannonMissile.default_blast_radius)
         self.missile_threshold = 0.01
-        self.projectiles = []
+        self.projectiles = projectiles.ProjectileStore()
         self.initial_buildings_sum = self.get_buildings_sum()
         self.buildings_sum = self.initial_buildings_sum
         self.score = 0
         
-    def __init__(self):
+    def new_game(self, seed=None):
+        """Start again from the beginning, with the given seed or a random
+        one."""
+        # all of the game's randomness comes from here, so a game can be
+        # replayed from its seed and input
+        if seed is None:
+            seed = random.getrandbits(32)
+        self.seed   = seed
+        self.random = random.Random(seed)
+        
+        self.tick_count       = 0
+        self.cities_lost      = 0
+        self.missiles_spawned = 0
+        self.reset()
+        
+    def __init__(self, headless=False, auto_mode=False, dirty_rects=False,
+                 profile=False, hud=False, seed=None, resolution=(640, 480),
+                 tile_size=64):
         self.buildings_colour = (0,0,10)   # blue-black
-        self.resolution = (640, 480)
-        self.auto_mode = False
-                
-        pygame.init()
+        self.resolution = tuple(resolution)
+        self.tile_size  = tile_size   # None keeps the buildings in one array
+        self.cities     = CityCache(get_cache_dir())
+        self.auto_mode = auto_mode
+        self.headless  = headless
+        self.seed      = seed
+        
+        # input comes from pygame, or from these InputFrames if set, or
+        # from input_queue when the simulation has its own thread;
+        # recorder, if set, is given the input of every tick
+        self.input_frames = None
+        self.input_queue  = None
+        self.last_input   = replay.InputFrame()
+        self.mouse_held   = False
+        self.recorder     = None
+        
+        # held while the simulation changes anything drawn from live data
+        self.lock = threading.Lock()
+        
+        # per-phase timings, shown next to the score if hud is set
+        self.show_hud = hud and not headless
+        if profile or hud:
+            self.profiler = profiling.Profiler()
+        else:
+            self.profiler = profiling.NullProfiler()
+            
+        # drawing is timed per frame; that's per tick too unless the
+        # simulation has its own thread, when run_threaded splits them
+        self.render_profiler = self.profiler
+
+        self.background  = None
+        self.shield_dome = None
+        
         pygame.surfarray.use_arraytype("numpy")        
+
+        if headless:
+            # simulation only: no display, font or input
+            self.score_font = None
+            self.hud_font   = None
+            self.screen = None
+            self.buildings_surface = None
+            self.renderer = None
+            self.new_game(seed)
+            return
+
+        # only what is used: pygame.init() would start audio and more
+        pygame.display.init()
+        pygame.font.init()
         
-#        self.score_font = pygame.font.Font(pygame.font.get_default_font(), 20)
-        self.score_font = pygame.font.Font(pygame.font.match_font("Monospace", True), 20)
-        self.reset()
+        fonts = FontFinder(get_cache_dir())
+        self.score_font = fonts.load("Monospace", 20, bold=True)
+        self.hud_font   = fonts.load("Monospace", 11)
+        self.new_game(seed)
         
+        # without an icon of our own, set_mode loads pygame's through
+        # pkg_resources, which is slow to import
+        pygame.display.set_icon(make_icon())
         self.screen = pygame.display.set_mode(self.resolution)
         pygame.display.set_caption("Missile defence")
 
@@ -190,117 +394,334 @@ class MissileDefenceGame(object):
         
         self.buildings_surface = pygame.Surface(self.resolution, 0, 8)
         self.buildings_surface.set_palette(((0,0,0), self.buildings_colour))
-        self.buildings_surface.set_colorkey(0, pygame.RLEACCEL)
+        # no RLEACCEL: the surface is written to most frames
+        self.buildings_surface.set_colorkey(0)
         
-    def generate_missile(self):
-        p = projectiles.Missile(position=(uniform(-500, self.resolution[0] + 500), -50),
-                                velocity=(uniform(-3, 3), 
-                                          uniform(2, 7)))
+        # redraw only what changed each frame, rather than everything
+        self.renderer = None
+        if dirty_rects:
+            self.renderer = DirtyRectRenderer(self)
         
-        count = 0
-        while p.position[1] < -20 and count < 100:
-            p.apply_physics(self.physics, self.buildings)
-            count += 1
+    def generate_missiles(self, count):
+        """Spawn count new enemy missiles, each advanced (in closed form)
+        until it is just above the top of the screen."""
+        rng = self.random
+        missiles = [projectiles.Missile(position=(rng.uniform(-500, self.resolution[0] + 500), -50),
+                                        velocity=(rng.uniform(-3, 3), 
+                                                  rng.uniform(2, 7)),
+                                        rng=rng)
+                    for i in range(count)]
+        if not missiles:
+            return missiles
             
-        return p
-
-    def handle_events(self):
-        force_fire = False
+        position = numpy.array([p.position for p in missiles])
+        velocity = numpy.array([p.velocity for p in missiles])
+        ticks = trajectory.ticks_until_y(position, velocity, -20, 100,
+                                         self.physics)
         
+        new_position, new_velocity = trajectory.advance(position, velocity,
+                                                        ticks, self.physics)
+        trails, trail_counts = trajectory.recent_positions(
+            position, velocity, ticks, projectiles.ProjectileStore.trail_capacity,
+            self.physics)
+            
+        for (i, p) in enumerate(missiles):
+            p.position = new_position[i].tolist()
+            p.velocity = new_velocity[i].tolist()
+            p.set_trail(trails[i, :min(trail_counts[i], p.trail_length)])
+        return missiles
+
+    def read_input(self):
+        """Handle pygame's events, returning the input for the simulation
+        as an InputFrame. This must be called on the main thread."""
+        frame = replay.InputFrame(mouse=pygame.mouse.get_pos(),
+                                  firing=self.mouse_held)
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
-                self.done = True
-            elif event.type == pygame.KEYDOWN and event.key == ord("q"):
-                self.done = True
+                frame.quit = True
             elif event.type == pygame.KEYDOWN and event.key == ord("s"): # screenshot
                 pygame.image.save(self.screen, "screenshot.png")
-            elif event.type == pygame.KEYDOWN and event.key == ord("a"): # auto mode
+            elif event.type == pygame.KEYDOWN:
+                frame.keys.append(event.key)
+            elif event.type == pygame.MOUSEBUTTONDOWN:
+                frame.mouse_down = True
+                frame.firing = True
+            elif event.type == pygame.MOUSEBUTTONUP:
+                frame.firing = False
+        self.mouse_held = frame.firing
+        return frame
+        
+    def take_queued_input(self):
+        """Everything read since the last tick from input_queue, as one
+        InputFrame."""
+        frame = None
+        while True:
+            try:
+                queued = self.input_queue.get_nowait()
+            except Queue.Empty:
+                break
+            if frame is None:
+                frame = queued
+            else:
+                frame.merge(queued)
+        if frame is None:
+            # nothing new: the mouse is where it was
+            frame = replay.InputFrame(mouse=self.last_input.mouse,
+                                      firing=self.last_input.firing)
+        return frame
+        
+    def poll_input(self):
+        """This tick's input, as an InputFrame."""
+        if self.input_frames is not None:
+            frame = next(self.input_frames, replay.InputFrame())
+        elif self.input_queue is not None:
+            frame = self.take_queued_input()
+        elif self.headless:
+            frame = replay.InputFrame()
+        else:
+            frame = self.read_input()
+        self.last_input = frame
+        return frame
+        
+    def handle_events(self):
+        frame = self.poll_input()
+        if self.recorder is not None:
+            self.recorder.record(frame)
+        self.apply_input(frame)
+        
+    def apply_input(self, frame):
+        force_fire = False
+        
+        if frame.quit:
+            self.done = True
+        for key in frame.keys:
+            if key == ord("q"):
+                self.done = True
+            elif key == ord("a"): # auto mode
                 self.auto_mode = not self.auto_mode
-            elif event.type == pygame.KEYDOWN and event.key == ord("r"): # reset
+            elif key == ord("r"): # reset
                 self.reset()
-            elif event.type == pygame.KEYDOWN and event.key == ord("d"):
+            elif key == ord("d"):
                 self.shield_dome.health += 20
-            elif event.type == pygame.MOUSEBUTTONDOWN:
-                force_fire  = True # fire event if there was a mouse up too
-                self.fire_cycle = 0
-                self.firing = True
-            elif event.type == pygame.MOUSEBUTTONUP:
-                self.firing = False
+        if frame.mouse_down:
+            force_fire  = True # fire event if there was a mouse up too
+            self.fire_cycle = 0
+        self.firing = frame.firing
        
-        stuff_nearby = any(
-            size_squared(array(p.position) - array(self.cannon.centre)) < p.radius * p.radius  
-            for p in self.projectiles)
+        position = self.projectiles.column("position")
+        offset   = position - self.cannon.centre
+        stuff_nearby = ((offset * offset).sum(axis=1) <
+                        self.projectiles.column("radius") ** 2).any()
             
-        if not self.auto_mode:
-            self.cannon.target = array(pygame.mouse.get_pos())
+        if not self.auto_mode and frame.mouse is not None:
+            self.cannon.target = array(frame.mouse)
 
         if not stuff_nearby:
             if self.auto_mode and self.cannon.can_fire():
-
-                valid_targets = [p for p in self.projectiles if
-                                 p.position[0] > 0 and p.position[1] > 0 and
-                                 p.position[0] < self.resolution[0] and
-                                 p.position[1] < self.resolution[1] - 300 and
-                                 p.velocity[1] > 0 and not p.exploding]
-                if len(valid_targets) > 0:
-                    target = random.choice(valid_targets)
-                    target_pos = array(target.position) + array(target.velocity) * 4
+                target_pos = self.choose_target()
+                if target_pos is not None:
                     self.cannon.fire(target_pos)
                     self.cannon.target = target_pos
                     
-            elif self.firing or force_fire:            
-                self.cannon.fire(pygame.mouse.get_pos()) 
+            elif (self.firing or force_fire) and frame.mouse is not None:
+                self.cannon.fire(frame.mouse)
                 
-    def get_buildings_sum(self):
-        # restart if most of the buildings are destroyed and no explosions in progress
-        sum = 0
-        for y in range(self.resolution[1] - 100, self.resolution[1]):
-            sum += numpy.ma.sum(self.buildings.pixeldata[y])
-        return sum
-        
-    def draw(self, intro=False):
-        self.background.draw(self.screen)
-        pygame.surfarray.blit_array(self.buildings_surface,
-                                    self.buildings.pixeldata)
-        
-        self.screen.blit(self.buildings_surface, (0,0))
-
-        self.shield_dome.draw(self.screen)
+    def choose_target(self):
+        """Where auto mode should fire, or None."""
+        store       = self.projectiles
+        position    = store.column("position")
+        velocity    = store.column("velocity")
+        cannon_fire = store.column("cannon_fire")
+        moving      = ~store.column("exploding")
+        
+        enemies = (moving & ~cannon_fire &
+                   (position[:, 0] > 0) & (position[:, 1] > 0) &
+                   (position[:, 0] < self.resolution[0]) &
+                   (velocity[:, 1] > 0))
+        shots = moving & cannon_fire
+        return self.targeting.choose(position[enemies], velocity[enemies],
+                                     store.column("blast_radius")[enemies],
+                                     position[shots], velocity[shots],
+                                     self.cannon.centre,
+                                     self.buildings.column_counts > 0)
                 
-        for p in self.projectiles:
-            p.draw(self.screen)
+    def state_digest(self):
+        """A SHA-1 digest of the simulation state: two games with the same
+        digest are (all but certainly) in the same state."""
+        digest = hashlib.sha1()
+        digest.update(self.buildings.map.to_array().tobytes())
+        for (name, shape, dtype) in projectiles.ProjectileStore.fields:
+            digest.update(self.projectiles.column(name).tobytes())
+        digest.update(repr((self.tick_count, self.score, self.auto_mode,
+                            self.missile_threshold, self.firing,
+                            self.shield_dome.health,
+                            self.cannon.ticks_since_firing,
+                            self.cannon.destroyed,
+                            list(self.cannon.target),
+                            list(self.background.grad.bottom_colour),
+                            self.random.getstate())).encode("utf-8"))
+        return digest.digest()
+        
+    def get_buildings_sum(self):
+        # kept up to date by Buildings as pixels are destroyed
+        return self.buildings.total
+        
+    def sync_buildings_surface(self):
+        """Copy the parts of the buildings changed since the last frame into
+        buildings_surface, and return them as rects."""
+        rects = self.buildings.take_modified_rects()
+        if rects:
+            pixels = pygame.surfarray.pixels2d(self.buildings_surface)
+            for (x, y, width, height) in rects:
+                # only the parts of the map with buildings are copied
+                pixels[x:x + width, y:y + height] = 0
+                for (block_x, block_y, block) in self.buildings.map.blocks(
+                        x, x + width, y, y + height):
+                    pixels[block_x:block_x + block.shape[0],
+                           block_y:block_y + block.shape[1]] = block
+            del pixels  # unlock the surface
+        return [pygame.Rect(r) for r in rects]
+        
+    def render_hud(self, score):
+        """The score, and the profiling overlay if it is on, as a list of
+        (surface, position) pairs."""
+        score_surf = self.score_font.render(format(score, "08"), True, (255,255,255))
+        hud = [(score_surf, (30, 30))]
+        if self.show_hud:
+            x, y = 30 + score_surf.get_width() + 20, 30
+            overlay = self.profiler.get_overlay(self.hud_font)
+            hud.append((overlay, (x, y)))
+            if self.render_profiler is not self.profiler:
+                hud.append((self.render_profiler.get_overlay(self.hud_font),
+                            (x, y + overlay.get_height() + 10)))
+        return hud
+        
+    def draw(self, state=None, intro=False):
+        """Draw state, a Snapshot, or the game as it is now if None."""
+        if state is None:
+            state = self
+        if self.renderer is not None:
+            self.renderer.draw(state)
+            return
             
-        self.cannon.draw(self.screen)
+        profiler = self.render_profiler
+        with profiler.phase("background"):
+            state.background.draw(self.screen)
+        with profiler.phase("buildings blit"):
+            with self.lock:
+                self.sync_buildings_surface()
+            self.screen.blit(self.buildings_surface, (0,0))
+            state.shield_dome.draw(self.screen)
+                
+        with profiler.phase("draw projectiles"):
+            state.projectiles.draw(self.screen)
+            state.cannon.draw(self.screen)
         
         # draw score
-        score_surf = self.score_font.render(format(self.score, "08"), True, (255,255,255))
-        self.screen.blit(score_surf, (30, 30))
-        pygame.display.flip()
+        for (surf, position) in self.render_hud(state.score):
+            self.screen.blit(surf, position)
+        with profiler.phase("flip"):
+            pygame.display.flip()
     
     
     
     def apply_physics(self):
-        self.physics.update_location_cache()
+        profiler = self.profiler
         
-        projectiles_keep = []  
-        # process projectiles
-        for p in self.projectiles:
-            p.apply_physics(self.physics, self.buildings)
+        # process projectiles, moving them all at once
+        with profiler.phase("projectiles"):
+            self.projectiles.advance(self.physics)
+        with profiler.phase("collision"):
+            self.physics.find_contacts()
+        with profiler.phase("projectiles"):
+            for p in self.projectiles:
+                p.update(self.physics, self.buildings)
             
-            # keep any projectiles that aren't destroyed/off-screen
-            if not p.is_garbage(self.resolution):
-               projectiles_keep.append(p)               
-        self.projectiles = projectiles_keep        
+            # discard any projectiles that are destroyed/off-screen, and
+            # keep them to make new ones from
+            projectiles.free_projectiles.release(
+                self.projectiles.collect_garbage(self.resolution,
+                                                 detach=False))
         self.buildings.apply_physics()   
-        self.cannon.apply_physics()
+        with profiler.phase("projectiles"):
+            self.cannon.apply_physics()
+        self.shield_dome.fade()
+        
+        profiler.count("projectiles", len(self.projectiles))
+        profiler.count("pairs tested", self.physics.pairs_tested)
+        profiler.count("unsettled cols", int(self.buildings.unsettled.sum()))
         
+
+    def tick(self):
+        """Advance the game by one tick, without drawing anything."""
+        with self.profiler.phase("events"):
+            self.handle_events()
+                    
+        self.tick_count += 1
+
+        if self.tick_count % 100 == 0:
+            self.background.darken()        
+            
+        # restart if most of the buildings are destroyed
+        self.buildings_sum = self.get_buildings_sum()
+        if float(self.buildings_sum) / self.initial_buildings_sum < 0.2:
+            self.cities_lost += 1
+            self.reset()
+            
+        if self.tick_count % 30 == 0:
+            self.score += 100
+                       
+        # randomly add more projectiles
+        self.missile_threshold += 0.0001
+        
+        m = self.missile_threshold
+        count = 0
+        while m > 0:
+            m -= self.random.random() 
+            if m > 0:
+                count += 1
+        self.projectiles.extend(self.generate_missiles(count))
+        self.missiles_spawned += count
+        
+        self.apply_physics()
+
+    def simulate(self, ticks=None):
+        """Run the game as fast as possible with no rendering or frame cap.
+
+        Stops after the given number of ticks (or when the game is quit)
+        and returns the number of ticks per second achieved.
+        """
+        self.done = False
+        count = 0
+        start = timeit.default_timer()
+        while not self.done and (ticks is None or count < ticks):
+            self.tick()
+            self.profiler.end_tick()
+            count += 1
+        elapsed = timeit.default_timer() - start
+        
+        if elapsed <= 0:
+            return float("inf")
+        return count / elapsed
                 
-    def run(self):                
+    def run(self, tick_rate=30, fps=60, threaded=True):
+        """Play until the player quits.
+        
+        If threaded is set the simulation runs tick_rate ticks a second on
+        a thread of its own, while this thread reads input and draws up to
+        fps frames a second, interpolating between ticks. Otherwise one
+        tick is simulated per frame, tick_rate times a second.
+        """
         clock = pygame.time.Clock()        
 
-        self.projectiles = [] 
-        tick_count = 0
+        self.projectiles = projectiles.ProjectileStore()
+        self.tick_count = 0
         self.done  = False
+        
+        if threaded:
+            self.run_threaded(clock, tick_rate, fps)
+            pygame.quit()
+            return
 
         # Introduction
         
@@ -312,37 +733,124 @@ class MissileDefenceGame(object):
         #     self.draw()
                     
         while not self.done:
-            clock.tick(30)
-            self.handle_events()
-                        
-            tick_count += 1
-
-            if tick_count % 100 == 0:
-                self.background.darken()        
-                
-            if tick_count % 30 == 0:
-                self.buildings_sum   = self.get_buildings_sum()
-                if float(self.buildings_sum) / self.initial_buildings_sum < 0.2:
-                    self.reset()
-             
-                self.score += 100
-                           
-            # randomly add more projectiles
-            self.missile_threshold += 0.0001
-            
-            m = self.missile_threshold
-            while m > 0:
-                m -= random.random() 
-                if m > 0:
-                    self.projectiles.append(self.generate_missile())
-            
-            self.apply_physics()
-            
+            clock.tick(tick_rate)
+            self.tick()
             self.draw()
+            self.profiler.end_tick()
         
         pygame.quit()           
+        
+    def run_threaded(self, clock, tick_rate, fps):
+        # ticks and frames happen at different rates, so they are timed
+        # separately: the simulation thread ends a tick in profiler, and
+        # each frame ends one in render_profiler
+        if not isinstance(self.profiler, profiling.NullProfiler):
+            self.render_profiler = profiling.Profiler(self.profiler.window)
+            
+        self.input_queue = Queue.Queue()
+        simulation = SimulationThread(self, tick_rate)
+        simulation.start()
+        
+        while not self.done and simulation.is_alive():
+            clock.tick(fps)
+            with self.render_profiler.phase("input"):
+                self.input_queue.put(self.read_input())
+            with simulation.get_frame() as state:
+                if state is not None:
+                    self.draw(state)
+            self.render_profiler.end_tick()
+            
+        self.done = True
+        simulation.join()
+        self.input_queue = None
             
 
 if __name__ == "__main__":
-    game = MissileDefenceGame()
-    game.run()
+    parser = argparse.ArgumentParser(description="Missile defence game")
+    parser.add_argument("--headless", action="store_true",
+                        help="simulate without a display, as fast as possible")
+    parser.add_argument("--ticks", type=int, default=1000,
+                        help="number of ticks to simulate in headless mode")
+    parser.add_argument("--auto", action="store_true",
+                        help="start in auto aiming and firing mode")
+    parser.add_argument("--dirty-rects", action="store_true",
+                        help="only redraw the parts of the screen that change")
+    parser.add_argument("--resolution", default="640x480",
+                        help="window size as WIDTHxHEIGHT (default 640x480)")
+    parser.add_argument("--dense-map", action="store_true",
+                        help="keep the buildings in one array rather than "
+                             "in tiles")
+    parser.add_argument("--tick-rate", type=int, default=30,
+                        help="simulation ticks per second (default 30)")
+    parser.add_argument("--fps", type=int, default=60,
+                        help="most frames to draw per second (default 60)")
+    parser.add_argument("--single-thread", action="store_true",
+                        help="simulate one tick per frame on the main thread")
+    parser.add_argument("--profile", metavar="FILE",
+                        help="time each part of a tick and write the results "
+                             "to FILE on exit (JSON if it ends in .json, "
+                             "otherwise CSV)")
+    parser.add_argument("--hud", action="store_true",
+                        help="show the profiling timings next to the score")
+    parser.add_argument("--seed", type=int,
+                        help="seed for the game's random numbers")
+    parser.add_argument("--record", metavar="FILE",
+                        help="record the seed and every tick's input to FILE")
+    parser.add_argument("--replay", metavar="FILE",
+                        help="re-run a recording headless, as fast as "
+                             "possible, and check it ends in the same state")
+    args = parser.parse_args()
+    
+    try:
+        resolution = tuple(int(n) for n in args.resolution.split("x"))
+    except ValueError:
+        resolution = ()
+    if len(resolution) != 2 or min(resolution) < 1:
+        parser.error("--resolution should be like 1920x1080")
+    tile_size = None if args.dense_map else 64
+    
+    if args.replay:
+        recording = replay.Replay(args.replay)
+        game, rate = recording.play(MissileDefenceGame)
+        print("%d ticks, %.1f ticks/sec, score %d" %
+              (game.tick_count, rate, game.score))
+        if recording.digest is None:
+            print("recording has no final state to check against")
+        elif game.state_digest() == recording.digest:
+            print("final state matches the recording")
+        else:
+            print("final state DIFFERS from the recording")
+            raise SystemExit(1)
+    elif args.headless:
+        game = MissileDefenceGame(headless=True, auto_mode=True,
+                                  profile=args.profile is not None,
+                                  seed=args.seed, resolution=resolution,
+                                  tile_size=tile_size)
+        if args.record:
+            game.recorder = replay.Recorder(args.record, game.seed,
+                                            game.resolution, game.auto_mode)
+        rate = game.simulate(args.ticks)
+        print("%d ticks, %.1f ticks/sec, score %d" %
+              (game.tick_count, rate, game.score))
+    else:
+        game = MissileDefenceGame(auto_mode=args.auto,
+                                  dirty_rects=args.dirty_rects,
+                                  profile=args.profile is not None,
+                                  hud=args.hud, seed=args.seed,
+                                  resolution=resolution, tile_size=tile_size)
+        if args.record:
+            game.recorder = replay.Recorder(args.record, game.seed,
+                                            game.resolution, game.auto_mode)
+        game.run(tick_rate=args.tick_rate, fps=args.fps,
+                 threaded=not args.single_thread)
+        
+    if game.recorder is not None:
+        game.recorder.close(game.state_digest())
+        
+    if args.profile:
+        game.profiler.dump(args.profile)
+        if game.render_profiler is not game.profiler:
+            # frame timings go next to the tick timings, e.g. timings.json
+            # and timings-frames.json
+            root, ext = os.path.splitext(args.profile)
+            game.render_profiler.dump(root + "-frames" + ext)
@@ -0,0 +1,202 @@
+"""
+    Missile Defence Game
+    Per-subsystem timers and counters.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import collections
+import csv
+import json
+import threading
+import timeit
+
+import numpy
+import pygame
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.profiler._enter()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler._exit(self.name)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+class NullProfiler(object):
+    """Stands in for a Profiler when profiling is off, doing nothing."""
+    _no_phase = _NoPhase()
+
+    def phase(self, name):
+        return self._no_phase
+
+    def count(self, name, value=1):
+        pass
+
+    def end_tick(self):
+        pass
+
+
+class Profiler(object):
+    """Times named phases of each tick and records per-tick counters.
+
+    Use "with profiler.phase(name):" around the code to time; time spent
+    in a phase nested inside another only counts towards the inner one.
+    A phase may be entered several times per tick and counters may be
+    added to several times: the totals are recorded by end_tick(), which
+    keeps the last window ticks for percentiles as well as running totals.
+    Phases may be timed on several threads at once.
+    """
+    percentiles = (50, 90, 99)
+
+    def __init__(self, window=300):
+        self.window   = window
+        self.ticks    = 0
+        self.timings  = collections.OrderedDict()  # name -> recent seconds
+        self.counters = collections.OrderedDict()  # name -> recent values
+        self.totals   = collections.defaultdict(float)
+
+        self._this_tick = collections.defaultdict(float)
+        self._counts    = collections.defaultdict(float)
+        self._lock      = threading.Lock()
+        
+        # per thread: a [start time, time in nested phases] stack
+        self._local = threading.local()
+
+        self.overlay         = None
+        self.overlay_tick    = None
+        self.overlay_refresh = 10  # ticks between re-rendering the overlay
+
+    def phase(self, name):
+        if name not in self.timings:
+            with self._lock:
+                self.timings.setdefault(
+                    name, collections.deque(maxlen=self.window))
+        return _Phase(self, name)
+
+    def _enter(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append([timeit.default_timer(), 0.0])
+
+    def _exit(self, name):
+        stack = self._local.stack
+        start, nested = stack.pop()
+        elapsed = timeit.default_timer() - start
+        if stack:
+            stack[-1][1] += elapsed
+        with self._lock:
+            self._this_tick[name] += elapsed - nested
+
+    def count(self, name, value=1):
+        with self._lock:
+            if name not in self.counters:
+                self.counters[name] = collections.deque(maxlen=self.window)
+            self._counts[name] += value
+
+    def end_tick(self):
+        with self._lock:
+            self._end_tick()
+
+    def _end_tick(self):
+        for (name, recent) in self.timings.items():
+            seconds = self._this_tick.get(name, 0.0)
+            recent.append(seconds)
+            self.totals[name] += seconds
+        for (name, recent) in self.counters.items():
+            recent.append(self._counts.get(name, 0))
+        self._this_tick.clear()
+        self._counts.clear()
+        self.ticks += 1
+
+    def _stats(self, values, scale):
+        values = numpy.array(values, float) * scale
+        if len(values) == 0:
+            values = numpy.zeros(1)
+        stats = collections.OrderedDict()
+        stats["mean"] = float(values.mean())
+        for (q, value) in zip(self.percentiles,
+                              numpy.percentile(values, self.percentiles)):
+            stats["p%d" % q] = float(value)
+        stats["max"] = float(values.max())
+        return stats
+
+    def get_summary(self):
+        """Rolling statistics: phase times in milliseconds per tick, and
+        counters per tick."""
+        with self._lock:
+            return self._get_summary()
+
+    def _get_summary(self):
+        summary = collections.OrderedDict()
+        summary["ticks"] = self.ticks
+        summary["phases"] = collections.OrderedDict(
+            (name, self._stats(recent, 1000.0))
+            for (name, recent) in self.timings.items())
+        for (name, stats) in summary["phases"].items():
+            stats["total_seconds"] = self.totals[name]
+        summary["counters"] = collections.OrderedDict(
+            (name, self._stats(recent, 1))
+            for (name, recent) in self.counters.items())
+        return summary
+
+    def dump(self, path):
+        """Write the summary to path, as JSON if it ends in .json and as
+        CSV otherwise."""
+        summary = self.get_summary()
+        if path.endswith(".json"):
+            with open(path, "w") as f:
+                json.dump(summary, f, indent=2)
+            return
+
+        columns = (["mean"] + ["p%d" % q for q in self.percentiles] +
+                   ["max"])
+        with open(path, "wb") as f:
+            writer = csv.writer(f)
+            writer.writerow(["kind", "name"] + columns + ["total_seconds"])
+            for (name, stats) in summary["phases"].items():
+                writer.writerow(["phase_ms", name] +
+                                ["%.4f" % stats[c] for c in columns] +
+                                ["%.4f" % stats["total_seconds"]])
+            for (name, stats) in summary["counters"].items():
+                writer.writerow(["counter", name] +
+                                ["%.1f" % stats[c] for c in columns] + [""])
+
+    def get_overlay(self, font):
+        """A surface listing the p50/p90 of every phase and counter,
+        re-rendered every overlay_refresh ticks."""
+        if (self.overlay is not None and
+                self.ticks - self.overlay_tick < self.overlay_refresh):
+            return self.overlay
+
+        summary = self.get_summary()
+        lines = ["%-16s %6s %6s" % ("", "p50", "p90")]
+        for (name, stats) in summary["phases"].items():
+            lines.append("%-16s %6.2f %6.2f ms" %
+                         (name, stats["p50"], stats["p90"]))
+        for (name, stats) in summary["counters"].items():
+            lines.append("%-16s %6d %6d" % (name, stats["p50"], stats["p90"]))
+
+        line_height = font.get_linesize()
+        width = max(font.size(line)[0] for line in lines)
+        self.overlay = pygame.Surface((width, line_height * len(lines)))
+        self.overlay.set_colorkey((0, 0, 0))
+        for (i, line) in enumerate(lines):
+            self.overlay.blit(font.render(line, True, (200, 255, 200)),
+                              (0, i * line_height))
+        self.overlay_tick = self.ticks
+        return self.overlay
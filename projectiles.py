@@ -8,66 +8,120 @@
 
 import pygame
 from background import grad
+from sprites import SpriteCache
 import random
-from random import uniform
 import numpy
+import math
+
+
+class _StoreField(object):
+    """An attribute that lives in a ProjectileStore column once the
+    projectile has been added to a store, and in the projectile itself
+    before that (or after it has been garbage collected)."""
+    def __init__(self, name):
+        self.name = name
+        
+    def __get__(self, p, owner):
+        if p is None:
+            return self
+        if p._store is None:
+            return p._fields[self.name]
+        return p._store.columns[self.name][p._slot]
+        
+    def __set__(self, p, value):
+        if p._store is None:
+            p._fields[self.name] = value
+        else:
+            p._store.columns[self.name][p._slot] = value
+
 
 class Projectile(object):
+    # no per-instance __dict__: anything that is the same for every
+    # projectile of a class is a class attribute
+    __slots__ = ("_store", "_slot", "_fields")
+    
+    position = _StoreField("position")
+    velocity = _StoreField("velocity")
+    radius   = _StoreField("radius")
+    
+    def __new__(cls, *args, **kwargs):
+        # reuse a garbage-collected projectile if there is one
+        return free_projectiles.take(cls)
+    
     def __init__(self, position, velocity, radius):
+        self._store   = None
+        self._slot    = None
+        self._fields  = {}
         self.position = [float(x) for x in position]
         self.velocity = [float(v) for v in velocity]
         self.radius   = radius
-        
-    def apply_physics(self, physics):
-        self.position[0] += self.velocity[0]
-        self.position[1] += self.velocity[1]
-        self.velocity[0] += physics.wind
-        self.velocity[1] += physics.gravity
-        self.velocity[0] *= physics.air_resistance
-        self.velocity[1] *= physics.air_resistance
 
     def get_int_position(self):
         return [int(x) for x in self.position]
 
 
 class Missile(Projectile):
-    def __init__(self, position, velocity):
-        self.draw_radius      = int(uniform(2, 7))    
-        Projectile.__init__(self, position, velocity, self.draw_radius)
-        self.trail            = []        
+    __slots__ = ("invulnerable_ticks", "size_increase_remaining",
+                 "destroyed_radius", "_trail_buffer")
+    
+    colour_front   = (250, 250, 250)
+    colour_tail    = (20, 20, 100)
+    blast_colour_a = (255, 255, 0)
+    blast_colour_b = (255, 0, 0)
+    
+    draw_radius      = _StoreField("draw_radius")
+    blast_radius     = _StoreField("blast_radius")
+    blast_ticks      = _StoreField("blast_ticks")
+    blast_ticks_done = _StoreField("blast_ticks_done")
+    exploding        = _StoreField("exploding")
+    cannon_fire      = _StoreField("cannon_fire")
+    
+    # the last trail_length positions, as a ring buffer
+    trail_points     = _StoreField("trail_points")
+    trail_start      = _StoreField("trail_start")
+    trail_count      = _StoreField("trail_count")
+    trail_length     = _StoreField("trail_length")
+    
+    # trails are drawn in this many colour bands, one draw call per band
+    trail_bands      = 4
+    
+    # (tail colour, front colour, draw radius, points, bands) -> trail style
+    _trail_styles    = {}
+    
+    def __init__(self, position, velocity, rng=random):
+        radius = int(rng.uniform(2, 7))
+        Projectile.__init__(self, position, velocity, radius)
+        # recycled missiles reuse the array they were made with
+        buffer = getattr(self, "_trail_buffer", None)
+        if buffer is None:
+            buffer = numpy.zeros((ProjectileStore.trail_capacity, 2))
+            self._trail_buffer = buffer
+        else:
+            buffer.fill(0)
+        self.trail_points     = buffer
+        self.trail_start      = 0
+        self.trail_count      = 0
         self.trail_length     = 10
         self.exploding        = False
         self.blast_ticks_done = 0
-        self.draw_radius      = int(uniform(2, 7))
+        self.draw_radius      = int(rng.uniform(2, 7))
         self.blast_radius     = self.draw_radius * 5
         self.blast_ticks      = (self.blast_radius * 4) / 3
-        self.colour_front     = (250, 250, 250)
-        self.colour_tail      = (20, 20, 100)
-        self.blast_colour_a   = (255, 255, 0)
-        self.blast_colour_b   = (255, 0, 0)        
         self.invulnerable_ticks = 0
         self.size_increase_remaining = 0
+        self.destroyed_radius = None  # extent of the blast damage done so far
         self.cannon_fire      = False
         
-    def is_garbage(self, resolution):
-        if self.exploding:
-            return self.blast_ticks_done > self.blast_ticks
-        elif self.position[1] > (resolution[1] + self.blast_radius + 
-                                 self.draw_radius): # off screen bttom
-            return True
-        elif self.position[0] > resolution[0] + 200 and \
-             self.velocity[0] > 0: # way off right
-             return True
-        elif self.position[0] < -200 and \
-             self.velocity[0] < 0: # way off left
-             return True
-        elif self.position[1] < -200 and \
-             self.velocity[1] < 0: # way off top
-             return True
-        else:
-            return False
+    def set_trail(self, points):
+        """Replace the trail with the given positions, oldest first."""
+        self.trail_points[:len(points)] = points
+        self.trail_start = 0
+        self.trail_count = len(points)
         
-    def apply_physics(self, physics, buildings):
+    def update(self, physics, buildings):
+        """Everything that happens to the projectile in a tick apart from
+        moving it and extending its trail, which ProjectileStore.advance
+        does for all projectiles at once."""
         if self.size_increase_remaining > 0:
             self.size_increase_remaining -= 1
             self.draw_radius += 0.5
@@ -77,53 +131,365 @@ class Missile(Projectile):
             self.blast_ticks_done += 1
             self.apply_explosion(buildings)
         else:           
-            Projectile.apply_physics(self, physics)
-            self.trail.append(list(self.position))
-            if len(self.trail) > self.trail_length: self.trail.pop(0)
-           
-            int_pos = self.get_int_position()
             if self.invulnerable_ticks == 0:
                 physics.check_collision(self)
             else:
                 self.invulnerable_ticks -= 1
 
  
-    def get_current_explosion_proportion(self):       
-        proportion = self.blast_ticks_done / float(self.blast_ticks)
-        return proportion
-        
     def get_current_explosion_radius(self):
-        proportion = self.get_current_explosion_proportion()
-        if proportion > 1.0:
-            proportion = 1.0  # don't explode too big on the final tick
-        
-        radius = self.blast_radius * proportion
-        return radius
+        return get_explosion_radius(self.blast_radius, self.blast_ticks_done,
+                                    self.blast_ticks)
         
     def apply_explosion(self, buildings):        
         self.blast_ticks_done += 1
         self.radius = int(self.get_current_explosion_radius()) - 1
-        buildings.destroy_circle(self.position, self.radius)
+        
+        # only the ring outside last tick's blast has anything left to destroy
+        buildings.destroy_circle(self.position, self.radius,
+                                 self.destroyed_radius)
+        if self.radius > 0:
+            self.destroyed_radius = self.radius
        
-    def draw(self, screen):       
-        prev_pos = None
-        i        = 0
-        for pos in self.trail:
-            i += 1
-            int_pos = [int(x) for x in pos]                
-            if prev_pos is not None:
-                pygame.draw.line(screen, grad(self.colour_tail,
-                                              self.colour_front, 
-                                              i / float(len(self.trail))),
-                                 int_pos, prev_pos,
-                                 int((i * self.draw_radius) / len(self.trail)))
-            prev_pos = int_pos
+    @classmethod
+    def get_trail_style(cls, colour_tail, colour_front, draw_radius, points,
+                        bands):
+        """How to draw a trail of the given number of points: a list of
+        (colour, width, first point, last point) polylines.
         
-        if self.exploding:
-            pygame.draw.circle(screen,
-                               grad(self.blast_colour_a,
-                                    self.blast_colour_b,
-                                    self.get_current_explosion_proportion()),
-                               self.get_int_position(),
-                               int(self.get_current_explosion_radius()))
+        Segment i (joining points i - 1 and i) is as wide as it would be
+        drawn on its own, and coloured by the gradient at the end of its
+        band, so neighbouring segments of the same band and width can be
+        drawn together. Zero-width segments are left out.
+        """
+        key = (tuple(colour_tail), tuple(colour_front), draw_radius, points,
+               bands)
+        style = cls._trail_styles.get(key)
+        if style is not None:
+            return style
+            
+        style = []
+        for i in range(2, points + 1):
+            width = int((i * draw_radius) / points)
+            if width < 1:
+                continue
+            band_end = int(math.ceil(i * bands / float(points))) / float(bands)
+            colour = tuple(grad(colour_tail, colour_front, band_end))
+            
+            if style and style[-1][:2] == (colour, width) and \
+               style[-1][3] == i - 2:
+                style[-1] = (colour, width, style[-1][2], i - 1)
+            else:
+                style.append((colour, width, i - 2, i - 1))
+                
+        cls._trail_styles[key] = style
+        return style
+
+
+def get_explosion_proportion(ticks_done, ticks):
+    return ticks_done / float(ticks)
+    
+def get_explosion_radius(blast_radius, ticks_done, ticks):
+    # don't explode too big on the final tick
+    return blast_radius * min(1.0, get_explosion_proportion(ticks_done, ticks))
+    
+def render_explosion(radius, colour):
+    """A sprite of a filled circle, drawn as pygame.draw.circle would draw
+    it centred on (radius, radius)."""
+    size = max(1, radius * 2 + 1)
+    transparent = (0, 0, 0) if tuple(colour) != (0, 0, 0) else (255, 255, 255)
+    
+    sprite = pygame.Surface((size, size))
+    sprite.fill(transparent)
+    sprite.set_colorkey(transparent, pygame.RLEACCEL)
+    pygame.draw.circle(sprite, colour, (radius, radius), radius)
+    return sprite
+    
+# explosion frames for every kind of missile, keyed by the blast size,
+# progress and colours
+explosion_sprites = SpriteCache(512)
+
 
+class ProjectilePool(object):
+    """Free lists of garbage-collected projectiles, one per class, that
+    new projectiles are made from instead of allocating. At most max_free
+    of each class are kept."""
+    def __init__(self, max_free):
+        self.max_free = max_free
+        self.free     = {}  # class -> list of projectiles
+        self.reused   = 0
+        self.created  = 0
+        
+    def take(self, cls):
+        """An uninitialised projectile of class cls."""
+        free = self.free.get(cls)
+        if free:
+            self.reused += 1
+            return free.pop()
+        self.created += 1
+        return object.__new__(cls)
+        
+    def release(self, projectiles):
+        """Put projectiles that nothing refers to any more on the free
+        lists."""
+        for p in projectiles:
+            free = self.free.setdefault(type(p), [])
+            if len(free) < self.max_free:
+                p._fields = None  # anything it was left with
+                free.append(p)
+                
+    def clear(self):
+        self.free.clear()
+        
+# the projectiles of every game in the process
+free_projectiles = ProjectilePool(1024)
+
+
+class ProjectileStore(object):
+    """Structure-of-arrays storage for the live projectiles.
+    
+    The per-projectile numbers are kept in NumPy columns so that movement
+    and garbage collection can be done for every projectile in one go.
+    Projectiles read and write their own row through _StoreField
+    attributes, and the store behaves like the list of projectiles it
+    replaces (append, iteration, len).
+    """
+    
+    # longest trail a projectile can have
+    trail_capacity = 10
+    
+    # name, shape of one row, dtype
+    fields = (("position",         (2,), numpy.float64),
+              ("velocity",         (2,), numpy.float64),
+              ("radius",           (),   numpy.float64),
+              ("draw_radius",      (),   numpy.float64),
+              ("blast_radius",     (),   numpy.float64),
+              ("blast_ticks",      (),   numpy.float64),
+              ("blast_ticks_done", (),   numpy.float64),
+              ("exploding",        (),   numpy.bool_),
+              ("cannon_fire",      (),   numpy.bool_),
+              ("trail_points",     (trail_capacity, 2), numpy.float64),
+              ("trail_start",      (),   numpy.int64),
+              ("trail_count",      (),   numpy.int64),
+              ("trail_length",     (),   numpy.int64),
+              ("serial",           (),   numpy.int64))
+              
+    # only used for drawing, so not part of the simulation state: taken
+    # from the projectile's class when it is added
+    style_fields = (("colour_front",   (3,), numpy.uint8),
+                    ("colour_tail",    (3,), numpy.uint8),
+                    ("blast_colour_a", (3,), numpy.uint8),
+                    ("blast_colour_b", (3,), numpy.uint8))
+              
+    def __init__(self, capacity=256):
+        self.count    = 0
+        self.capacity = capacity
+        self.objects  = []
+        self.columns  = {}
+        
+        # every projectile appended gets the next serial number, so it can
+        # be matched up between copies of the store made on different ticks
+        self.next_serial = 0
+        for (name, shape, dtype) in self.fields + self.style_fields:
+            self.columns[name] = numpy.zeros((capacity,) + shape, dtype)
+            
+    def __len__(self):
+        return self.count
+        
+    def __iter__(self):
+        return iter(self.objects)
+        
+    def column(self, name):
+        """The live part of a column (a view, so writes go through)."""
+        return self.columns[name][:self.count]
+        
+    def _grow(self):
+        self.capacity *= 2
+        for name in self.columns:
+            old = self.columns[name]
+            new = numpy.zeros((self.capacity,) + old.shape[1:], old.dtype)
+            new[:self.count] = old[:self.count]
+            self.columns[name] = new
+            
+    def append(self, p):
+        if self.count == self.capacity:
+            self._grow()
+            
+        slot = self.count
+        for (name, shape, dtype) in self.fields:
+            self.columns[name][slot] = p._fields.get(name, 0)
+        for (name, shape, dtype) in self.style_fields:
+            self.columns[name][slot] = getattr(p, name)
+        self.columns["serial"][slot] = self.next_serial
+        self.next_serial += 1
+        
+        p._store  = self
+        p._slot   = slot
+        p._fields = None
+        self.objects.append(p)
+        self.count += 1
+        
+    def extend(self, new_projectiles):
+        for p in new_projectiles:
+            self.append(p)
+        
+    def copy_from(self, store):
+        """Make this store's columns the same as store's, reusing its
+        arrays. It has no projectile objects, so is only for drawing."""
+        while self.capacity < store.count:
+            self._grow()
+        for name in self.columns:
+            self.columns[name][:store.count] = store.column(name)
+        self.count       = store.count
+        self.next_serial = store.next_serial
+        
+    def get_trail(self, slot):
+        """The trail positions of the projectile in slot, oldest first."""
+        start  = self.columns["trail_start"][slot]
+        count  = self.columns["trail_count"][slot]
+        length = self.columns["trail_length"][slot]
+        indices = (start + numpy.arange(count)) % length
+        return self.columns["trail_points"][slot][indices]
+        
+    def get_draw_rects(self):
+        """Bounding rects of everything draw() paints, one per projectile."""
+        position = self.column("position").astype(int).tolist()
+        exploding = self.column("exploding").tolist()
+        draw_radius = self.column("draw_radius").tolist()
+        blast = zip(self.column("blast_radius").tolist(),
+                    self.column("blast_ticks_done").tolist(),
+                    self.column("blast_ticks").tolist())
+        
+        rects = []
+        for slot in xrange(self.count):
+            points = self.get_trail(slot).astype(int).tolist()
+            margin = int(draw_radius[slot]) + 1
+            if exploding[slot]:
+                points.append(position[slot])
+                radius = get_explosion_radius(*blast[slot])
+                margin = max(margin, int(radius) + 1)
+            if not points:
+                rects.append(pygame.Rect(position[slot], (0, 0)))
+                continue
+                
+            xs = [x for (x, y) in points]
+            ys = [y for (x, y) in points]
+            rects.append(pygame.Rect(min(xs) - margin, min(ys) - margin,
+                                     max(xs) - min(xs) + margin * 2 + 1,
+                                     max(ys) - min(ys) + margin * 2 + 1))
+        return rects
+        
+    def draw(self, screen):
+        """Draw every projectile's trail, and explosion if it has one."""
+        position = self.column("position").astype(int).tolist()
+        exploding = self.column("exploding").tolist()
+        draw_radius = self.column("draw_radius").tolist()
+        blast = zip(self.column("blast_radius").tolist(),
+                    self.column("blast_ticks_done").tolist(),
+                    self.column("blast_ticks").tolist())
+        colour_front = self.column("colour_front").tolist()
+        colour_tail = self.column("colour_tail").tolist()
+        blast_colour_a = self.column("blast_colour_a").tolist()
+        blast_colour_b = self.column("blast_colour_b").tolist()
+        
+        for slot in xrange(self.count):
+            trail = self.get_trail(slot).astype(int).tolist()
+            style = Missile.get_trail_style(colour_tail[slot],
+                                            colour_front[slot],
+                                            draw_radius[slot], len(trail),
+                                            Missile.trail_bands)
+            for (colour, width, first, last) in style:
+                pygame.draw.lines(screen, colour, False,
+                                  trail[first:last + 1], width)
+                
+            if exploding[slot]:
+                (blast_radius, ticks_done, ticks) = blast[slot]
+                radius = int(get_explosion_radius(*blast[slot]))
+                colour_a = tuple(blast_colour_a[slot])
+                colour_b = tuple(blast_colour_b[slot])
+                key = blast[slot] + (colour_a, colour_b)
+                proportion = get_explosion_proportion(ticks_done, ticks)
+                sprite = explosion_sprites.get(key, lambda: render_explosion(
+                    radius, grad(colour_a, colour_b, proportion)))
+                    
+                x, y = position[slot]
+                screen.blit(sprite, (x - radius, y - radius))
+                
+    def _detach(self, p):
+        p._fields = dict((name, self.columns[name][p._slot].tolist())
+                         for (name, shape, dtype) in self.fields)
+        p._store  = None
+        p._slot   = None
+        
+    def advance(self, physics):
+        """Move every projectile that isn't exploding by one tick, and
+        extend its trail."""
+        moving   = ~self.column("exploding")
+        position = self.column("position")
+        velocity = self.column("velocity")
+        
+        velocity_moving = velocity[moving]
+        position[moving] += velocity_moving
+        velocity_moving += (physics.wind, physics.gravity)
+        velocity_moving *= physics.air_resistance
+        velocity[moving] = velocity_moving
+        
+        # add the new positions to the trails
+        moved  = numpy.flatnonzero(moving & (self.column("trail_length") > 0))
+        length = self.column("trail_length")[moved]
+        start  = self.column("trail_start")[moved]
+        count  = self.column("trail_count")[moved]
+        full   = count >= length
+        
+        index = numpy.where(full, start, (start + count) % length)
+        self.column("trail_points")[moved, index] = position[moved]
+        self.column("trail_start")[moved] = numpy.where(full,
+                                                        (start + 1) % length,
+                                                        start)
+        self.column("trail_count")[moved] = numpy.minimum(count + 1, length)
+        
+    def garbage_mask(self, resolution):
+        """Which projectiles are finished with: blown up, or gone off the
+        screen and heading away."""
+        x, y   = self.column("position").T
+        vx, vy = self.column("velocity").T
+        
+        blown_up = self.column("blast_ticks_done") > self.column("blast_ticks")
+        gone     = ((y > resolution[1] + self.column("blast_radius") +
+                         self.column("draw_radius")) |      # off screen bottom
+                    ((x > resolution[0] + 200) & (vx > 0)) | # way off right
+                    ((x < -200) & (vx < 0)) |                # way off left
+                    ((y < -200) & (vy < 0)))                 # way off top
+        return numpy.where(self.column("exploding"), blown_up, gone)
+        
+    def collect_garbage(self, resolution, detach=True):
+        """Remove destroyed/off-screen projectiles, compacting the columns.
+        
+        Returns the removed projectiles. With detach set they keep their
+        values; otherwise they are left with nothing, which is all a
+        ProjectilePool needs.
+        """
+        if self.count == 0:
+            return []
+        
+        keep = ~self.garbage_mask(resolution)
+        if keep.all():
+            return []
+            
+        removed = [p for (p, k) in zip(self.objects, keep) if not k]
+        for p in removed:
+            if detach:
+                self._detach(p)
+            else:
+                p._store = p._slot = p._fields = None
+            
+        kept = [p for (p, k) in zip(self.objects, keep) if k]
+        for name in self.columns:
+            column = self.columns[name]
+            column[:len(kept)] = column[:self.count][keep]
+            
+        for (slot, p) in enumerate(kept):
+            p._slot = slot
+        self.objects = kept
+        self.count   = len(kept)
+        return removed
@@ -0,0 +1,107 @@
+"""
+    Missile Defence Game
+    Dirty-rectangle rendering.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import pygame
+
+
+class DirtyRectRenderer(object):
+    """Draws the game by repainting only the parts of the screen that have
+    changed since the last frame and pushing just those to the display.
+
+    Regions that are repainted each frame: where every projectile (trail
+    and blast) and the cannon are now and were last frame, the score, the
+    parts of the buildings that were damaged or collapsed, and the dome
+    when its flash or opacity changes. The sky, with its stars, is kept in a
+    layer that is re-rendered on a full redraw. That happens when the sky
+    colour changes, after a reset, and every full_redraw_interval frames
+    so the stars keep twinkling.
+    """
+    def __init__(self, game, full_redraw_interval=30):
+        self.game = game
+        self.full_redraw_interval = full_redraw_interval
+        self.background_layer = pygame.Surface(game.resolution)
+        self.screen_rect      = pygame.Rect((0, 0), game.resolution)
+
+        self.previous_rects = []
+        self.frames_since_full_redraw = None
+        self.sky_colour = None
+        self.dome_state = None
+        self.scene      = None  # background, buildings and dome drawn
+
+    def _needs_full_redraw(self, state):
+        scene = (state.background, state.buildings)
+        return (self.frames_since_full_redraw is None or
+                self.frames_since_full_redraw >= self.full_redraw_interval or
+                tuple(state.background.grad.bottom_colour) != self.sky_colour or
+                scene != self.scene)
+
+    def _draw_foreground(self, state, hud):
+        game = self.game
+        with game.render_profiler.phase("draw projectiles"):
+            state.projectiles.draw(game.screen)
+            state.cannon.draw(game.screen)
+        for (surf, position) in hud:
+            game.screen.blit(surf, position)
+
+    def draw(self, state):
+        """Draw state: the game itself or a Snapshot of it."""
+        game     = self.game
+        screen   = game.screen
+        profiler = game.render_profiler
+
+        with profiler.phase("buildings blit"):
+            with game.lock:
+                building_rects = game.sync_buildings_surface()
+        hud = game.render_hud(state.score)
+
+        with profiler.phase("draw projectiles"):
+            current_rects = state.projectiles.get_draw_rects()
+        current_rects.append(state.cannon.get_draw_rect())
+        current_rects.extend(surf.get_rect(topleft=position)
+                             for (surf, position) in hud)
+
+        dome_state = state.shield_dome.get_state()
+        full = self._needs_full_redraw(state)
+
+        if full:
+            with profiler.phase("background"):
+                state.background.draw(self.background_layer)
+            self.sky_colour = tuple(state.background.grad.bottom_colour)
+            self.scene = (state.background, state.buildings)
+            self.frames_since_full_redraw = 0
+
+            with profiler.phase("buildings blit"):
+                screen.blit(self.background_layer, (0, 0))
+                screen.blit(game.buildings_surface, (0, 0))
+                state.shield_dome.draw(screen)
+            self._draw_foreground(state, hud)
+            with profiler.phase("flip"):
+                pygame.display.flip()
+        else:
+            self.frames_since_full_redraw += 1
+
+            dirty = self.previous_rects + current_rects + building_rects
+            if dome_state != self.dome_state:
+                dirty.append(state.shield_dome.get_screen_rect())
+            dirty = [r.clip(self.screen_rect) for r in dirty]
+            dirty = [r for r in dirty if r.width > 0 and r.height > 0]
+
+            with profiler.phase("buildings blit"):
+                for r in dirty:
+                    screen.blit(self.background_layer, r, r)
+                    screen.blit(game.buildings_surface, r, r)
+                    state.shield_dome.blit_area(screen, r)
+            self._draw_foreground(state, hud)
+            with profiler.phase("flip"):
+                pygame.display.update(dirty)
+            profiler.count("dirty rects", len(dirty))
+            profiler.count("dirty pixels", sum(r.width * r.height
+                                               for r in dirty))
+
+        self.previous_rects = current_rects
+        self.dome_state     = dome_state
@@ -0,0 +1,129 @@
+"""
+    Missile Defence Game
+    Recording and replaying the player's input.
+
+    A replay file is a header, one record per tick and a trailer:
+
+        header   "MDRP", version (uint16), seed (uint32), width, height
+                 (uint16 each), auto mode (uint8)
+        tick     mouse x, mouse y (int16 each), flags (uint8), key count
+                 (uint8), then that many key codes (uint32 each, as
+                 pygame 2's codes for keys like shift don't fit in 16 bits)
+        trailer  flags 0xff, then the 20 byte state digest at the end
+
+    All little-endian. Most ticks take 6 bytes.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import struct
+
+MAGIC   = b"MDRP"
+VERSION = 3  # 2: cities come from citycache, 3: 32 bit key codes
+
+_HEADER = struct.Struct("<4sHIHHB")
+_TICK   = struct.Struct("<hhBB")
+_KEY    = struct.Struct("<I")
+
+_FIRING     = 1  # mouse button held at the end of the tick
+_MOUSE_DOWN = 2  # mouse button pressed during the tick
+_QUIT       = 4
+_NO_MOUSE   = 8  # no mouse position (headless)
+_END        = 0xff
+
+
+class InputFrame(object):
+    """The player's input for one tick: where the mouse is (or None),
+    whether the button is held and whether it was pressed during the tick,
+    the keys pressed, in order, and whether the window was closed."""
+    def __init__(self, mouse=None, firing=False, mouse_down=False, keys=(),
+                 quit=False):
+        self.mouse      = mouse
+        self.firing     = firing
+        self.mouse_down = mouse_down
+        self.keys       = list(keys)
+        self.quit       = quit
+
+    def merge(self, later):
+        """Add the input of a later frame to this one, as if both had
+        happened in the same tick."""
+        self.mouse       = later.mouse
+        self.firing      = later.firing
+        self.mouse_down |= later.mouse_down
+        self.keys.extend(later.keys)
+        self.quit       |= later.quit
+
+
+class Recorder(object):
+    def __init__(self, path, seed, resolution, auto_mode):
+        self.file = open(path, "wb")
+        self.file.write(_HEADER.pack(MAGIC, VERSION, seed, resolution[0],
+                                     resolution[1], auto_mode))
+        self.ticks = 0
+
+    def record(self, frame):
+        flags = ((_FIRING if frame.firing else 0) |
+                 (_MOUSE_DOWN if frame.mouse_down else 0) |
+                 (_QUIT if frame.quit else 0))
+        if frame.mouse is None:
+            flags |= _NO_MOUSE
+            x, y = 0, 0
+        else:
+            x, y = frame.mouse
+        self.file.write(_TICK.pack(x, y, flags, len(frame.keys)))
+        for key in frame.keys:
+            self.file.write(_KEY.pack(key))
+        self.ticks += 1
+
+    def close(self, digest):
+        """Finish the file with the state digest of the game after the
+        last tick, so a replay can check it ends up in the same state."""
+        self.file.write(_TICK.pack(0, 0, _END, 0))
+        self.file.write(digest)
+        self.file.close()
+
+
+class Replay(object):
+    """A recording read back from a file: its seed, resolution, initial
+    auto mode, input frames and the state digest it finished with (None if
+    the recording wasn't closed properly)."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+
+        (magic, version, self.seed, width, height,
+         auto_mode) = _HEADER.unpack_from(data, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %d replay" %
+                             (path, VERSION))
+        self.resolution = (width, height)
+        self.auto_mode  = bool(auto_mode)
+
+        self.frames = []
+        self.digest = None
+        offset = _HEADER.size
+        while offset + _TICK.size <= len(data):
+            x, y, flags, key_count = _TICK.unpack_from(data, offset)
+            offset += _TICK.size
+            if flags == _END:
+                self.digest = data[offset:]
+                break
+            keys = [_KEY.unpack_from(data, offset + i * _KEY.size)[0]
+                    for i in range(key_count)]
+            offset += key_count * _KEY.size
+            self.frames.append(InputFrame(
+                mouse=None if flags & _NO_MOUSE else (x, y),
+                firing=bool(flags & _FIRING),
+                mouse_down=bool(flags & _MOUSE_DOWN),
+                keys=keys,
+                quit=bool(flags & _QUIT)))
+
+    def play(self, game_class):
+        """Re-run the recording headless, as fast as possible, and return
+        the game and its rate in ticks per second."""
+        game = game_class(headless=True, auto_mode=self.auto_mode,
+                          seed=self.seed, resolution=self.resolution)
+        game.input_frames = iter(self.frames)
+        rate = game.simulate(len(self.frames))
+        return game, rate
@@ -0,0 +1,176 @@
+"""
+    Missile Defence Game
+    Fixed-timestep simulation on its own thread.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import contextlib
+import threading
+import time
+import timeit
+
+import numpy
+
+from projectiles import ProjectileStore
+
+
+def _copy(obj, into=None):
+    """A shallow copy of obj, reusing into if it's of the same class."""
+    if type(into) is not type(obj):
+        into = object.__new__(type(obj))
+    into.__dict__.update(obj.__dict__)
+    return into
+
+
+class Snapshot(object):
+    """What is needed to draw the game as it was after one tick.
+
+    Snapshots are made once and filled in again by update() every tick,
+    so the projectiles are a ProjectileStore of columns only (drawn with
+    ProjectileStore.draw) whose arrays are reused. The cannon and dome
+    are copies. The background and buildings are the live objects: the
+    stars only change when drawn, and the buildings are copied to the
+    screen under the game's lock. time is when the tick was due, or None
+    before the first update. lock is held while it's updated or drawn.
+    """
+    def __init__(self):
+        self.lock        = threading.Lock()
+        self.time        = None
+        self.tick_count  = 0
+        self.score       = 0
+        self.projectiles = ProjectileStore()
+        self.source      = None  # the game's store when it was copied
+        self.cannon      = None
+        self.shield_dome = None
+        self.background  = None
+        self.buildings   = None
+
+        # where the projectiles really are, and where the ones in matched
+        # were a tick before: the copied positions are overwritten with
+        # ones in between for drawing
+        self.position     = numpy.zeros((0, 2))
+        self.old_position = numpy.zeros((0, 2))
+        self.matched      = numpy.zeros(0, int)
+
+    def update(self, game, time, previous):
+        """Copy the game as it is now into the snapshot. previous is the
+        snapshot of the tick before, which may be None."""
+        self.time        = time
+        self.tick_count  = game.tick_count
+        self.score       = game.score
+        self.cannon      = _copy(game.cannon, self.cannon)
+        self.shield_dome = _copy(game.shield_dome, self.shield_dome)
+        self.background  = game.background
+        self.buildings   = game.buildings
+
+        store = self.projectiles
+        store.copy_from(game.projectiles)
+        if len(self.position) < store.capacity:
+            self.position     = numpy.zeros((store.capacity, 2))
+            self.old_position = numpy.zeros((store.capacity, 2))
+        position = self.position[:store.count]
+        position[...] = store.column("position")
+
+        # projectiles are matched by serial number, which starts again
+        # with each store, so not across a reset
+        self.matched = self.matched[:0]
+        if previous is not None and previous.source is game.projectiles and \
+           previous.projectiles.count > 0:
+            # the stores keep projectiles in serial number order
+            serial     = store.column("serial")
+            old_serial = previous.projectiles.column("serial")
+            index = numpy.minimum(numpy.searchsorted(old_serial, serial),
+                                  len(old_serial) - 1)
+            self.matched = numpy.flatnonzero(old_serial[index] == serial)
+            self.old_position[self.matched] = \
+                previous.position[index[self.matched]]
+        self.source = game.projectiles
+
+    def interpolate(self, alpha):
+        """Move the projectiles to alpha (0 to 1) of the way from where
+        they were a tick before to where they are now. Projectiles that
+        are new since then stay where they are."""
+        store    = self.projectiles
+        position = store.column("position")
+        position[...] = self.position[:store.count]
+        if len(self.matched) == 0:
+            return
+
+        slots = self.matched
+        old = self.old_position[slots]
+        position[slots] = old + (self.position[slots] - old) * alpha
+
+        # the newest point of each trail is the projectile's position
+        count = store.column("trail_count")[slots]
+        slots = slots[count > 0]
+        start  = store.column("trail_start")[slots]
+        length = store.column("trail_length")[slots]
+        count  = store.column("trail_count")[slots]
+        store.column("trail_points")[slots, (start + count - 1) % length] = \
+            position[slots]
+
+
+class SimulationThread(threading.Thread):
+    """Calls game.tick() tick_rate times a second until game.done is set,
+    holding game.lock while it does, and ends the tick in game.profiler.
+
+    After each tick the game is copied into the back of two Snapshots,
+    which is then swapped with the front one that get_frame() draws
+    from. The simulation only waits for a frame if it's a whole tick
+    ahead of it.
+
+    If the simulation falls more than max_lag seconds behind it skips
+    ahead rather than trying to catch up.
+    """
+    def __init__(self, game, tick_rate=30, max_lag=0.25):
+        threading.Thread.__init__(self, name="simulation")
+        self.daemon    = True
+        self.game      = game
+        self.interval  = 1.0 / tick_rate
+        self.max_lag   = max_lag
+        self.front     = Snapshot()
+        self.back      = Snapshot()
+        self.swap_lock = threading.Lock()
+
+    def run(self):
+        game = self.game
+        due  = timeit.default_timer()
+        while not game.done:
+            now = timeit.default_timer()
+            if now < due:
+                time.sleep(due - now)
+                continue
+            if now - due > self.max_lag:
+                due = now
+
+            with game.lock:
+                game.tick()
+            game.profiler.end_tick()
+
+            back = self.back
+            with back.lock:
+                back.update(game, due, self.front)
+            with self.swap_lock:
+                self.front, self.back = back, self.front
+            due += self.interval
+
+    @contextlib.contextmanager
+    def get_frame(self):
+        """The snapshot to draw now, with its projectiles interpolated to
+        one tick before the present, or None before the first tick. Use
+        it in a with statement: it's not changed until that ends."""
+        with self.swap_lock:
+            snapshot = self.front
+            snapshot.lock.acquire()
+        try:
+            if snapshot.time is None:
+                yield None
+            else:
+                alpha = ((timeit.default_timer() - snapshot.time) /
+                         self.interval)
+                snapshot.interpolate(min(1.0, max(0.0, alpha)))
+                yield snapshot
+        finally:
+            snapshot.lock.release()
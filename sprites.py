@@ -0,0 +1,57 @@
+"""
+    Missile Defence Game
+    Cache of pre-rendered sprites.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import collections
+
+
+def get_sprite_bytes(sprite):
+    """Memory used by a surface's pixels."""
+    return sprite.get_pitch() * sprite.get_height()
+
+
+class SpriteCache(object):
+    """A bounded cache of pre-rendered surfaces, holding at most
+    max_entries sprites and max_bytes of pixels (either may be None for no
+    limit). When it is full the least recently used sprites are evicted;
+    the newest is always kept, however big it is."""
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes   = max_bytes
+        self.sprites     = collections.OrderedDict()
+        self.bytes       = 0
+        self.hits        = 0
+        self.misses      = 0
+
+    def __len__(self):
+        return len(self.sprites)
+
+    def get(self, key, render):
+        """The sprite for key, calling render() to create it if needed."""
+        sprite = self.sprites.pop(key, None)
+        if sprite is None:
+            self.misses += 1
+            sprite = render()
+            self.bytes += get_sprite_bytes(sprite)
+        else:
+            self.hits += 1
+
+        # (re)insert as the most recently used
+        self.sprites[key] = sprite
+        while len(self.sprites) > 1 and self._is_over_limit():
+            (evicted_key, evicted) = self.sprites.popitem(last=False)
+            self.bytes -= get_sprite_bytes(evicted)
+        return sprite
+
+    def _is_over_limit(self):
+        return ((self.max_entries is not None and
+                 len(self.sprites) > self.max_entries) or
+                (self.max_bytes is not None and self.bytes > self.max_bytes))
+
+    def clear(self):
+        self.sprites.clear()
+        self.bytes = 0
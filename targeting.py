@@ -0,0 +1,130 @@
+"""
+    Missile Defence Game
+    Predictive targeting for auto mode.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+"""
+
+import math
+import numpy
+
+import trajectory
+
+
+class InterceptSolver(object):
+    """Picks where auto mode should aim the cannon.
+
+    Every enemy is tracked forward with the physics model to find the tick
+    at which a shot fired now at the cannon's speed can meet it. Targets
+    are ranked by their threat to the city: blast size over time to
+    impact, doubled for missiles coming down on buildings. Enemies that
+    a shot already in flight will catch are left alone. Each candidate
+    volley (the centre shot and the two spread shots) is scored by the
+    total threat of every enemy it would catch, and the best is chosen.
+    All of this is done with arrays, one pass per tick.
+    """
+    def __init__(self, physics, resolution, speed, spread, shot_reach,
+                 max_ticks=60):
+        self.physics    = physics
+        self.resolution = resolution
+        self.speed      = speed
+        self.spread     = spread
+        self.shot_reach = shot_reach
+        self.ticks      = numpy.arange(1, max_ticks + 1)
+        self.s, self.drift = trajectory.coefficients(self.ticks, physics)
+
+    def get_threat(self, position, velocity, blast_radius, city_columns):
+        city_top = self.resolution[1] - 100
+        ticks = trajectory.ticks_until_y(position, velocity, city_top, 300,
+                                         self.physics)
+        landing = trajectory.advance(position, velocity, ticks,
+                                     self.physics)[0]
+        landing_x = landing[:, 0].astype(int)
+        over_city = numpy.zeros(len(position), bool)
+        on_screen = (landing_x >= 0) & (landing_x < len(city_columns))
+        over_city[on_screen] = city_columns[landing_x[on_screen]]
+        return blast_radius * (1.0 + over_city) / (1.0 + ticks)
+
+    def choose(self, position, velocity, blast_radius, shot_position,
+               shot_velocity, centre, city_columns):
+        """Where to aim, as a point, or None if nothing can be hit.
+
+        position, velocity and blast_radius describe the enemies that can
+        be targeted; shot_position and shot_velocity the cannon shots
+        already in flight; city_columns is true for each x with buildings.
+        """
+        if len(position) == 0:
+            return None
+        centre = numpy.asarray(centre, float)
+
+        # where each enemy will be after each tick: (enemies, ticks, 2)
+        path = trajectory.advance(position[:, numpy.newaxis],
+                                  velocity[:, numpy.newaxis],
+                                  self.ticks, self.physics)[0]
+
+        # leave alone anything a shot in flight will catch
+        if len(shot_position):
+            shot_path = trajectory.advance(shot_position[:, numpy.newaxis],
+                                           shot_velocity[:, numpy.newaxis],
+                                           self.ticks, self.physics)[0]
+            gap = path[:, numpy.newaxis] - shot_path[numpy.newaxis]
+            caught = ((gap * gap).sum(axis=3) <
+                      self.shot_reach * self.shot_reach).any(axis=(1, 2))
+        else:
+            caught = numpy.zeros(len(position), bool)
+
+        # launch velocity needed to meet each enemy at each tick
+        needed = ((path - centre - self.drift) /
+                  self.s[:, numpy.newaxis])
+        needed_speed = numpy.sqrt((needed * needed).sum(axis=2))
+        reachable = ((needed_speed <= self.speed) &
+                     (needed[..., 1] <= 0) &     # the cannon can't aim down
+                     (path[..., 0] >= 0) &
+                     (path[..., 0] < self.resolution[0]) &
+                     (path[..., 1] < self.resolution[1] - 100))
+        reachable[caught] = False
+        candidates = numpy.flatnonzero(reachable.any(axis=1))
+        if len(candidates) == 0:
+            return None
+
+        # the first tick we can get there is where the needed speed drops
+        # to our speed: interpolate between it and the tick before
+        first = reachable[candidates].argmax(axis=1)
+        before = numpy.maximum(first - 1, 0)
+        speed_first  = needed_speed[candidates, first]
+        speed_before = needed_speed[candidates, before]
+        with numpy.errstate(invalid="ignore", divide="ignore"):
+            blend = numpy.where(
+                (first > 0) & (speed_before > speed_first),
+                (speed_before - self.speed) / (speed_before - speed_first),
+                1.0)
+        blend = numpy.clip(blend, 0.0, 1.0)[:, numpy.newaxis]
+        aim = (needed[candidates, before] * (1 - blend) +
+               needed[candidates, first] * blend)
+        aim /= numpy.sqrt((aim * aim).sum(axis=1))[:, numpy.newaxis]
+
+        # score each volley by the threat of everything it would catch
+        threat = self.get_threat(position, velocity, blast_radius,
+                                 city_columns)
+        threat[caught] = 0
+        tick = first
+        targets_then = path[:, tick].transpose(1, 0, 2)  # (candidates, enemies, 2)
+        caught_by_volley = numpy.zeros((len(candidates), len(position)), bool)
+        for theta in self.spread:
+            cos_theta = math.cos(theta)
+            sin_theta = math.sin(theta)
+            shot_velocity_now = self.speed * numpy.column_stack(
+                (aim[:, 0] * cos_theta - aim[:, 1] * sin_theta,
+                 aim[:, 0] * sin_theta + aim[:, 1] * cos_theta))
+            shot_then = (centre + self.s[tick, numpy.newaxis] * shot_velocity_now +
+                         self.drift[tick])
+            gap = targets_then - shot_then[:, numpy.newaxis]
+            caught_by_volley |= ((gap * gap).sum(axis=2) <
+                                 self.shot_reach * self.shot_reach)
+        value = (caught_by_volley * threat).sum(axis=1)
+
+        best = value.argmax()
+        if value[best] <= 0:
+            best = threat[candidates].argmax()
+        return centre + aim[best] * 100
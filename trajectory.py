@@ -0,0 +1,99 @@
+"""
+    Missile Defence Game
+    Closed-form projectile trajectories.
+
+    Copyright (C) 2011-2016 Ryan Lothian.
+    See LICENSE (Apache 2).
+
+    Each tick a projectile moves by its velocity, then its velocity has
+    wind and gravity added and is multiplied by the air resistance:
+
+        p' = p + v
+        v' = (v + a) * k
+
+    so after n ticks, with v_inf = k * a / (1 - k) the terminal velocity,
+
+        v_n = v_inf + k^n (v_0 - v_inf)
+        p_n = p_0 + n v_inf + (v_0 - v_inf) (1 - k^n) / (1 - k)
+
+    All functions take arrays of positions and velocities (one per row)
+    so that whole waves can be handled at once.
+"""
+
+import numpy
+
+
+def _acceleration(physics):
+    return numpy.array([physics.wind, physics.gravity], float)
+
+
+def coefficients(ticks, physics):
+    """(S, drift) such that after n ticks a projectile that started at p_0
+    with velocity v_0 is at p_0 + S * v_0 + drift.
+
+    S has the shape of ticks and drift has an extra last axis of 2.
+    """
+    n = numpy.asarray(ticks, float)
+    a = _acceleration(physics)
+    k = float(physics.air_resistance)
+
+    if k == 1.0:
+        return n, a * (n * (n - 1) / 2)[..., numpy.newaxis]
+
+    s     = (1 - k ** n) / (1 - k)
+    v_inf = k * a / (1 - k)
+    return s, v_inf * (n - s)[..., numpy.newaxis]
+
+
+def advance(position, velocity, ticks, physics):
+    """Positions and velocities after the given number of ticks.
+
+    position and velocity are (..., 2) arrays; ticks is a number or an
+    array that broadcasts against them without the last axis.
+    """
+    position = numpy.asarray(position, float)
+    velocity = numpy.asarray(velocity, float)
+    n = numpy.asarray(ticks, float)[..., numpy.newaxis]
+    a = _acceleration(physics)
+    k = float(physics.air_resistance)
+
+    s, drift = coefficients(ticks, physics)
+    new_position = position + s[..., numpy.newaxis] * velocity + drift
+
+    if k == 1.0:
+        return new_position, velocity + n * a
+
+    v_inf = k * a / (1 - k)
+    return new_position, v_inf + k ** n * (velocity - v_inf)
+
+
+def ticks_until_y(position, velocity, y, max_ticks, physics):
+    """For each projectile, the number of ticks until it is at or below
+    height y (i.e. its y coordinate is at least y), capped at max_ticks."""
+    position = numpy.asarray(position, float).reshape(-1, 2)
+    velocity = numpy.asarray(velocity, float).reshape(-1, 2)
+    ticks = numpy.arange(max_ticks + 1)
+
+    # every tick count for every projectile: shape (projectiles, ticks)
+    ys = advance(position[:, numpy.newaxis], velocity[:, numpy.newaxis],
+                 ticks, physics)[0][..., 1]
+    reached = ys >= y
+    return numpy.where(reached.any(axis=1), reached.argmax(axis=1), max_ticks)
+
+
+def recent_positions(position, velocity, ticks, count, physics):
+    """The positions after each of the last count ticks up to and
+    including the given number of ticks (fewer if the projectile hasn't
+    moved that many), oldest first, as a (projectiles, count, 2) array
+    and how many of each row are valid."""
+    position = numpy.asarray(position, float).reshape(-1, 2)
+    velocity = numpy.asarray(velocity, float).reshape(-1, 2)
+    ticks = numpy.asarray(ticks).reshape(-1)
+
+    valid = numpy.minimum(ticks, count)
+    offsets = numpy.arange(count) - count + 1
+    steps = ticks[:, numpy.newaxis] - valid[:, numpy.newaxis] + count + offsets
+    steps = numpy.minimum(steps, ticks[:, numpy.newaxis])
+    points = advance(position[:, numpy.newaxis], velocity[:, numpy.newaxis],
+                     steps, physics)[0]
+    return points, valid